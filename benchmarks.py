@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+
+# Benchmarks for pyxargs, run with: python benchmarks.py [--scale 0.1] [--output results.json] [--compare baseline.json]
+# Each stage (split, build, filter, pack, dispatch) is timed in process on synthetic inputs, and each execution backend
+# is timed end to end by running pyxargs as a subprocess. Only the standard library is required, pandas and duckdb are
+# benchmarked if installed. Results are the best of --repeat runs in seconds.
+
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import typing
+
+import pyxargs
+
+
+PYXARGS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pyxargs.py")
+DELIMITERS = {"whitespace": [], "null": ["-0"], "lines": ["-l"], "comma": ["-d", ","]}
+
+
+def make_args(*argv: str, input_mode: str = "stdin", base_dir: typing.Optional[str] = None) -> argparse.Namespace:
+    """parse arguments the same way as pyxargs, without reading stdin"""
+    args = pyxargs.build_parser().parse_args(list(argv))
+    args.input_mode = input_mode
+    args.base_dir = os.getcwd() if base_dir is None else base_dir
+    pyxargs.prepare_args(args)
+    return args
+
+
+def make_items(count: int) -> typing.List[str]:
+    return [f"dir{k % 100}/file{k:07d}.txt" for k in range(count)]
+
+
+def make_text(items: typing.List[str], delim: typing.Optional[str]) -> str:
+    return ("\n" if delim is None else delim).join(items) + "\n"
+
+
+def make_tree(root: str, depth: int, branches: int, files: int) -> int:
+    """create a directory tree with branches subdirectories and files files per directory, returns the number of files"""
+    total = 0
+    for k in range(files):
+        with open(os.path.join(root, f"file{k}.{'csv' if k % 2 else 'txt'}"), "w") as fd:
+            fd.write("a,b,c\n1,2,3\n4,5,6\n")
+        total += 1
+    if depth > 0:
+        for k in range(branches):
+            subdirectory = os.path.join(root, f"sub{k}")
+            os.mkdir(subdirectory)
+            total += make_tree(subdirectory, depth - 1, branches, files)
+    return total
+
+
+def best_of(repeat: int, function: typing.Callable, *params) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*params)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def run_pyxargs(argv: typing.List[str], stdin: bytes, cwd: typing.Optional[str] = None) -> None:
+    result = subprocess.run([sys.executable, PYXARGS] + argv, input=stdin, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, cwd=cwd)
+    if result.returncode != 0:
+        raise RuntimeError(f"pyxargs {argv} exited with {result.returncode}: {result.stderr.decode(errors='replace')}")
+
+
+def read_file_items(path: str, delim: typing.Optional[str]) -> typing.List[str]:
+    with open(path, "rb") as fd:
+        return list(pyxargs.read_items(fd, delim))
+
+
+def benchmark_stages(scale: float, repeat: int) -> dict:
+    """time splitting input, building, filtering, and packing commands, and dispatching python code, in process"""
+    results = {}
+    items = make_items(max(1, int(1_000_000 * scale)))
+    for name, options in DELIMITERS.items():
+        args = make_args(*options, "echo")
+        text = make_text(items, args.delim)
+        encoded = text.encode()
+        results[f"split/{name}"] = best_of(repeat, lambda: text.rstrip().split(args.delim))
+        results[f"split_stream/{name}"] = best_of(repeat, lambda: list(pyxargs.split_stream(io.TextIOWrapper(io.BytesIO(encoded)), args.delim)))
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, "items")
+            with open(path, "wb") as fd:
+                fd.write(encoded)
+            results[f"read_items/{name}"] = best_of(repeat, read_file_items, path, args.delim)
+    args = make_args("echo")
+    results["build"] = best_of(repeat, lambda: list(pyxargs.generate_commands(args, items)))
+    args = make_args("-r", "7\\.txt$", "echo")
+    results["filter"] = best_of(repeat, lambda: list(pyxargs.generate_commands(args, items)))
+    args = make_args("echo")
+    results["pack"] = best_of(repeat, lambda: list(pyxargs.pack_commands(args, pyxargs.generate_commands(args, items))))
+    args = make_args("--max-args", "0", "echo")
+    results["pack/max_args"] = best_of(repeat, lambda: list(pyxargs.pack_commands(args, pyxargs.generate_commands(args, items))))
+    for name, options in {"pyex": ["-x", "pass"], "pyev": ["-e", "x"], "pypr": ["-p", "{x}"]}.items():
+        args = make_args(*options)
+        commands = pyxargs.build_commands(args, make_text(items, None))
+        with contextlib.redirect_stdout(io.StringIO()) as devnull:
+            results[f"dispatch/{name}"] = best_of(repeat, lambda: (devnull.seek(0), devnull.truncate(), pyxargs.execute_commands(args, commands)))
+    return results
+
+
+def benchmark_walk(scale: float, repeat: int) -> dict:
+    """time walking deep and wide directory trees in each file input mode, with and without a filter"""
+    results = {}
+    trees = {"deep": (8, 2, max(1, int(40 * scale))), "wide": (1, 4, max(1, int(20000 * scale)))}
+    for tree, shape in trees.items():
+        with tempfile.TemporaryDirectory() as root:
+            make_tree(root, *shape)
+            for mode in ["file", "path", "abspath"]:
+                for name, options in {"": [], "/filter": ["-r", "\\.csv$"], "/folders": ["--folders"], "/unsorted": ["--unsorted"]}.items():
+                    args = make_args(*options, "echo", input_mode=mode, base_dir=root)
+                    results[f"walk/{tree}/{mode}{name}"] = best_of(repeat, lambda: list(pyxargs.generate_commands(args, [])))
+    return results
+
+
+def benchmark_backends(scale: float, repeat: int) -> dict:
+    """time each execution backend end to end, including interpreter startup"""
+    results = {}
+    spawn_items = make_items(max(1, int(500 * scale)))
+    python_items = make_items(max(1, int(100_000 * scale)))
+    spawn_stdin = make_text(spawn_items, None).encode()
+    python_stdin = make_text(python_items, None).encode()
+    json_stdin = "\n".join(json.dumps({"a": k, "b": str(k)}) for k in range(len(python_items))).encode()
+    results["startup"] = best_of(repeat, run_pyxargs, ["-e", "x"], b"")
+    backends = {
+        "subprocess": (["true"], spawn_stdin),
+        "shell": (["--sh", "true"], spawn_stdin),
+        "jobs": (["-j", "4", "true"], spawn_stdin),
+        "jobs/keep_order": (["-j", "4", "-k", "true"], spawn_stdin),
+        "max_args": (["--max-args", "0", "true"], python_stdin),
+        "pyex": (["-x", "pass"], python_stdin),
+        "pyev": (["-e", "x"], python_stdin),
+        "pypr": (["-p", "{x}"], python_stdin),
+        "fstring": (["-f", "--dry-run", "echo", "{x}"], python_stdin),
+        "json": (["-l", "--js", "-e", "js['a']"], json_stdin),
+        "no_mux": (["-P", "4", "--no-mux", "--chunksize", "64", "-e", "x"], python_stdin),
+        "stream": (["--stream", "-e", "x"], python_stdin),
+    }
+    for name, (argv, stdin) in backends.items():
+        results[f"backend/{name}"] = best_of(repeat, run_pyxargs, argv, stdin)
+    with tempfile.TemporaryDirectory() as root:
+        make_tree(root, 2, 4, max(1, int(50 * scale)))
+        if importlib.util.find_spec("pandas") is not None:
+            results["backend/df"] = best_of(repeat, run_pyxargs, ["-m", "path", "-r", "\\.csv$", "--df", "-e", "len(df)"], b"", root)
+        if importlib.util.find_spec("duckdb") is not None:
+            results["backend/sql"] = best_of(repeat, run_pyxargs, ["-m", "path", "-r", "\\.csv$", "-q", "SELECT count(*) FROM db"], b"", root)
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> int:
+    """print the ratio of each result to the baseline and return the number of regressions beyond threshold"""
+    regressions = 0
+    print(f"{'benchmark':<40}{'baseline':>12}{'current':>12}{'ratio':>8}", file=sys.stderr)
+    for name, seconds in results.items():
+        if name not in baseline:
+            continue
+        ratio = seconds / baseline[name] if baseline[name] > 0 else float("inf")
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        elif ratio < 1 - threshold:
+            flag = "  improved"
+        print(f"{name:<40}{baseline[name]:>12.4f}{seconds:>12.4f}{ratio:>8.2f}{flag}", file=sys.stderr)
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark pyxargs stages and execution backends")
+    parser.add_argument("--scale", type=float, default=1.0, help="scale the size of workloads, 1.0 uses 1M stdin items, default: 1.0")
+    parser.add_argument("--repeat", type=int, default=3, help="number of runs to take the best of, default: 3")
+    parser.add_argument("--only", choices=["stages", "walk", "backends"], action="append", default=[], help="only run these groups of benchmarks")
+    parser.add_argument("--output", type=str, default=None, metavar="file", help="write results as json to file instead of stdout")
+    parser.add_argument("--compare", type=str, default=None, metavar="baseline", help="compare results with a previous json output, exits with 1 if any regressed")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative slowdown considered a regression with --compare, default: 0.1")
+    args = parser.parse_args()
+    groups = {"stages": benchmark_stages, "walk": benchmark_walk, "backends": benchmark_backends}
+    results = {}
+    for name, benchmark in groups.items():
+        if not args.only or name in args.only:
+            results.update(benchmark(args.scale, args.repeat))
+    output = {
+        "meta": {
+            "pyxargs": pyxargs.__version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "scale": args.scale,
+            "repeat": args.repeat,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        },
+        "results": results,
+    }
+    if args.output is None:
+        print(json.dumps(output, indent=2))
+    else:
+        with open(args.output, "w") as fd:
+            json.dump(output, fd, indent=2)
+    if args.compare is not None:
+        with open(args.compare, "r") as fd:
+            baseline = json.load(fd)["results"]
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -16,25 +16,56 @@
 
 # https://github.com/elesiuta/pyxargs
 
+# modules that are slow to import and only needed for some options are imported where they are used
 import argparse
+import atexit
+import codecs
+import collections
+import collections.abc
+import contextlib
+import functools
+import gc
 import io
-import json
-import multiprocessing
+import itertools
+import math
 import os
-import pickle
 import re
 import shlex
-import shutil
 import signal
-import site
-import subprocess
 import sys
-import tempfile
 import time
+import types
 import typing
 
+if not sys.platform.startswith("win32"):
+    import fcntl
+
+if typing.TYPE_CHECKING:
+    import concurrent.futures
+    import subprocess
+
 
 __version__: typing.Final[str] = "3.4.6"
+OUTPUT_SPOOL_SIZE: typing.Final[int] = 256 * 1024
+PROGRESS_INTERVAL: typing.Final[float] = 0.5
+# --worker sends a heartbeat at this interval while it runs a lease, the coordinator hands the lease out again if it hears nothing for SERVE_TIMEOUT
+SERVE_HEARTBEAT: typing.Final[float] = 5.0
+SERVE_TIMEOUT: typing.Final[float] = 30.0
+JSONL_BATCH_SIZE: typing.Final[int] = 1024 * 1024
+MMAP_WINDOW: typing.Final[int] = 4 * 1024 * 1024
+# file formats read with --sql by extension, otherwise detected from their first bytes and cached per extension
+SQL_FORMATS: typing.Final[dict] = {".csv": "csv", ".tsv": "csv", ".txt": "csv", ".json": "json", ".jsonl": "json", ".ndjson": "json",
+                                   ".parquet": "parquet", ".pq": "parquet", ".duckdb": "duckdb", ".ddb": "duckdb", ".sqlite": "sqlite", ".sqlite3": "sqlite"}
+SQL_SCANS: typing.Final[dict] = {"csv": "read_csv_auto", "json": "read_json_auto", "parquet": "read_parquet"}
+
+# optional state shared by building and executing commands, set by main and execute_commands
+joblog = None
+incremental_cache = None
+stats = None
+throttle = None
+result_sink = None
+sql_format_cache = {}
+sql_stdin_file = None
 
 
 def replace_surrogates(string: str) -> str:
@@ -61,50 +92,407 @@ def colour_print(cmd: list, colour: str) -> None:
         print(COLOURS[colour] + str(safe_cmd) + END)
 
 
-def build_commands(args: argparse.Namespace, stdin: str) -> list:
-    command_dicts = [{"all_inputs": []}]
-    append_input = not (args.pyex or args.pyev or args.pyprt or args.sql or args.resub or args.format_str or args.fstring) and (args.replace_str is None) and all("{}" not in arg for arg in args.command)
-    args.replace_str = "{}" if args.replace_str is None else args.replace_str
+def split_stream(fd: typing.TextIO, delim: typing.Optional[str], size: int = 65536) -> typing.Iterator[str]:
+    """incrementally read and split input items as they arrive, equivalent to fd.read().rstrip().split(delim)"""
+    if hasattr(fd, "buffer"):
+        # read1 returns whatever is available instead of blocking until size bytes arrive
+        read = fd.buffer.read1
+        decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder(fd.encoding)(fd.errors or "strict"), translate=True)
+    else:
+        read = fd.read
+        decoder = None
+    remainder = ""
+    held = []
+    emitted = False
+    # rstrip could remove part of a delimiter such as ",\n" so items are only safe once followed by non-whitespace
+    partial_delim = delim is not None and delim.rstrip() not in ("", delim)
+    while True:
+        chunk = read(size)
+        data = chunk if decoder is None else decoder.decode(chunk, final=not chunk)
+        buffer = remainder + data
+        if not chunk:
+            break
+        if delim is None:
+            parts = buffer.split()
+            # the last part may continue in the next chunk
+            remainder = parts.pop() if parts and not buffer[-1].isspace() else ""
+            yield from parts
+            emitted = emitted or bool(parts)
+        else:
+            parts = buffer.split(delim)
+            remainder = parts.pop()
+            for part in parts:
+                # parts ending in whitespace are held back until it is known whether they are trailing (removed by rstrip)
+                if partial_delim:
+                    if part.strip():
+                        yield from held
+                        emitted = emitted or bool(held)
+                        held = []
+                    held.append(part)
+                elif part and not part[-1].isspace():
+                    yield from held
+                    yield part
+                    held = []
+                    emitted = True
+                else:
+                    held.append(part)
+    # emulate rstrip on whatever followed the last emitted item
+    if delim is None:
+        yield from buffer.split()
+    elif emitted:
+        yield from (delim + delim.join(held + [buffer])).rstrip().split(delim)[1:]
+    else:
+        yield from delim.join(held + [buffer]).rstrip().split(delim)
+
+
+def read_items(fd: typing.BinaryIO, delim: typing.Optional[str], size: int = 1024 * 1024) -> typing.Iterator[str]:
+    """lazily split input items from a binary file, equivalent to fd.read().rstrip().split(delim), decoded like os.fsdecode so names
+    that are not valid utf-8 are passed to commands unchanged
+
+    regular files split by a single byte delimiter (such as -0 or -l) are memory mapped and split in blocks ending at a delimiter,
+    with pages released every MMAP_WINDOW bytes once they have been split so memory stays bounded, otherwise (or if they contain
+    carriage returns, which are translated to newlines) the input is decoded in blocks as it arrives by split_stream
+    """
+    import mmap
+    import stat
+    encoding, errors = sys.getfilesystemencoding(), sys.getfilesystemencodeerrors()
+    separator = delim.encode(encoding, errors) if delim is not None else b""
+    try:
+        info = os.fstat(fd.fileno())
+        mapped = len(separator) == 1 and stat.S_ISREG(info.st_mode) and info.st_size > fd.tell()
+    except (OSError, ValueError):
+        mapped = False
+    if mapped:
+        with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            start = released = fd.tell()
+
+            def release(position: int) -> int:
+                # the pages stay in the page cache, but are no longer counted as memory used by this process
+                if hasattr(mmap, "MADV_DONTNEED"):
+                    data.madvise(mmap.MADV_DONTNEED, 0, position - position % mmap.PAGESIZE)
+                return position
+
+            # emulate rstrip by decoding the end of the input a piece at a time until it is not all whitespace
+            end = len(data)
+            while end > start:
+                piece = data[max(start, end - 4096):end]
+                kept = len(piece.decode(encoding, "surrogateescape").rstrip().encode(encoding, "surrogateescape"))
+                end -= len(piece) - kept
+                if kept:
+                    break
+            carriage_return = -1
+            for offset in range(start, end, MMAP_WINDOW):
+                carriage_return = data.find(b"\r", offset, min(offset + MMAP_WINDOW, end))
+                release(min(offset + MMAP_WINDOW, end))
+                if carriage_return != -1:
+                    break
+            if carriage_return == -1:
+                while True:
+                    # split up to the last delimiter in the next block, or to the end, a block is extended if an item is longer
+                    stop = -1 if start + size < end else end
+                    extent = size
+                    while stop == -1 and start + extent < end:
+                        stop = data.rfind(separator, start, start + extent)
+                        extent *= 2
+                    if stop == -1:
+                        stop = end
+                    yield from data[start:stop].decode(encoding, errors).split(delim)
+                    if stop == end:
+                        return
+                    start = stop + 1
+                    if start - released >= MMAP_WINDOW:
+                        released = release(start)
+    text = io.TextIOWrapper(fd, encoding, errors)
+    try:
+        yield from split_stream(text, delim)
+    finally:
+        # leave fd open, such as stdin
+        text.detach()
+
+
+class Command:
+    """an input and the directory to run its command in, kept compact since there may be millions of them
+
+    the command line is only built by command_line() when it is about to run, the directory string is shared by every
+    input in the same directory, batch holds the inputs packed into one command line with --max-args, and state holds
+    the file state to record with --incremental (or a list of them for a batch), size the total size of its files from
+    the walk for --order size-desc, and rss the peak memory of the process that ran it for --results
+    """
+    __slots__ = ("dir", "input", "batch", "state", "size", "rss")
+
+    def __init__(self, dir_path: str, arg_input: str, batch: typing.Optional[list] = None, state: typing.Any = None, size: typing.Optional[int] = None) -> None:
+        self.dir = dir_path
+        self.input = arg_input
+        self.batch = batch
+        self.state = state
+        self.size = size
+        self.rss = None
+
+
+class InputView(collections.abc.Sequence):
+    """read only view of the inputs of a list of commands for the variable a, so they are not copied"""
+
+    def __init__(self, commands: list) -> None:
+        self.commands = commands
+
+    def __len__(self) -> int:
+        return len(self.commands)
+
+    def __getitem__(self, index: typing.Union[int, slice]) -> typing.Union[str, list]:
+        if isinstance(index, slice):
+            return [command.input for command in self.commands[index]]
+        return self.commands[index].input
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+    def __reduce__(self) -> tuple:
+        # sent to pool workers as a list of the inputs instead of the commands
+        return list, (list(self),)
+
+
+def build_commands(args: argparse.Namespace, arg_inputs: typing.Iterable[str]) -> list:
+    # stdin is split by read_items as it is read, which is only timed if the inputs are used (for input mode: stdin)
+    arg_inputs = timed_items("read", arg_inputs)
+    # count the inputs as they are used, zip stops without advancing the counter once they run out
+    counter = itertools.count()
+    if stats is not None and args.input_mode == "stdin":
+        arg_inputs = (arg_input for arg_input, _ in zip(arg_inputs, counter))
+    # walking the directory tree and filtering are interleaved with building commands, garbage collection is paused
+    # since it would otherwise repeatedly traverse every command built so far, which are all kept until the end
+    with timed_phase("build"):
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            commands = pack_commands(args, generate_commands(args, arg_inputs))
+            commands = list(union_commands(args, commands) if args.sql_union or args.df_concat else commands)
+        finally:
+            if gc_enabled:
+                gc.enable()
+    if stats is not None and "read" in stats.phases:
+        # reading is interleaved with building, so it is reported as its own phase rather than twice
+        stats.phases["build"] -= stats.phases["read"]
+    if args.order is not None:
+        with timed_phase("order"):
+            commands = order_commands(args, commands)
+    if stats is not None and args.input_mode == "stdin":
+        stats.filtered = next(counter) - sum(len(command.batch) if command.batch is not None else 1 for command in commands)
+    return commands
+
+
+def order_commands(args: argparse.Namespace, commands: list) -> list:
+    """reorder commands for --order, the largest or longest running first so parallel runs do not end with a long tail, or randomly"""
+    ordered = list(enumerate(commands))
+    if args.order == "random":
+        import random
+        random.shuffle(ordered)
+    else:
+        inputs = lambda command: command.batch if command.batch is not None else (command.input,)
+        if args.order == "size-desc":
+            # the size of files found by the walk is kept from their directory entries, only inputs from stdin are stat here
+            cost = lambda command: command.size if command.size is not None else sum(input_size(args, command.dir, arg_input) for arg_input in inputs(command))
+        else:
+            # inputs without a previous duration are expected to take the mean
+            durations = load_durations(args.joblog)
+            mean = sum(durations.values()) / len(durations) if durations else 0.0
+            cost = lambda command: sum(durations.get(job_key(args, command.dir, arg_input), mean) for arg_input in inputs(command))
+        # a stable sort, so inputs of the same cost stay in walk order
+        ordered.sort(key=lambda item: cost(item[1]), reverse=True)
+    # remember both positions of each command so the statistics can estimate the makespan in either order
+    if stats is not None:
+        stats.positions = {(command.dir, command.input): (original, position) for position, (original, command) in enumerate(ordered)}
+    return [command for _, command in ordered]
+
+
+def input_size(args: argparse.Namespace, dir_path: str, arg_input: str) -> int:
+    """size of the file an input refers to, relative to the directory its command runs in, or 0 if it is not a file"""
+    try:
+        return os.stat(os.path.join(dir_path, arg_input) if args.input_mode == "file" else arg_input).st_size
+    except (OSError, ValueError):
+        return 0
+
+
+def entry_size(entry: os.DirEntry) -> int:
+    """size of the file a directory entry refers to (following symlinks like os.stat), or 0 if it cannot be read"""
+    try:
+        return entry.stat().st_size
+    except OSError:
+        return 0
+
+
+def generate_commands(args: argparse.Namespace, arg_inputs: typing.Iterable[str]) -> typing.Iterator[Command]:
+    """lazily build commands from input items (for input mode: stdin) or by walking the directory tree"""
+    # inputs already completed according to the job log are skipped
+    completed = load_joblog(args.joblog, args.resume_failed) if args.resume or args.resume_failed else None
     # build commands using standard input mode or by walking the directory tree
     if args.input_mode == "stdin":
-        # remove trailing whitespace and split stdin
-        stdin = stdin.rstrip()
-        arg_input_list = stdin.split(args.delim)
-        # build commands from stdin
-        for arg_input in arg_input_list:
-            command, arg_input, arg_input_split = build_command(args, "", "", arg_input, append_input)
-            if command:
-                command_dicts.append({"dir": args.base_dir, "cmd": command, "input": arg_input, "input_split": arg_input_split})
-                command_dicts[0]["all_inputs"].append(arg_input)
+        for arg_input in arg_inputs:
+            arg_input = select_input(args, "", "", arg_input)
+            if arg_input is not None and not (completed and is_completed(args, completed, args.base_dir, arg_input)):
+                yield Command(args.base_dir, arg_input)
     elif args.input_mode in ['file', 'path', 'abspath']:
-        for dir_path, folder_list, file_list in os.walk(args.base_dir, topdown=True, followlinks=args.symlinks):
-            folder_list.sort()
-            if args.folders:
-                # build commands from directory names
-                for folder_name in sorted(folder_list):
-                    command, arg_input, arg_input_split = build_command(args, dir_path, folder_name, "", append_input)
-                    if command:
-                        command_dicts.append({"dir": dir_path, "cmd": command, "input": arg_input, "input_split": arg_input_split})
-                        command_dicts[0]["all_inputs"].append(arg_input)
+        # build commands from filenames or file paths (or directory names with --folders)
+        sized = args.order == "size-desc"
+        for dir_path, rel_dir, entry in walk_tree(args):
+            arg_input = select_input(args, dir_path, entry.name, "", rel_dir + entry.name)
+            if arg_input is not None and not (completed and is_completed(args, completed, dir_path, arg_input)):
+                if incremental_cache is None:
+                    yield Command(dir_path, arg_input, size=entry_size(entry) if sized else None)
+                    continue
+                # skip files that have not changed since the command last succeeded, otherwise record their state once it does
+                file_state = incremental_cache.check(entry)
+                if file_state is not None:
+                    yield Command(dir_path, arg_input, state=file_state, size=entry_size(entry) if sized else None)
+                elif args.verbose:
+                    colour_print([f"Input skipped, unchanged since last run: {arg_input}"], "R")
+        if incremental_cache is not None:
+            incremental_cache.walk_complete = True
+
+
+def is_completed(args: argparse.Namespace, completed: set, dir_path: str, arg_input: str) -> bool:
+    if job_key(args, dir_path, arg_input) in completed:
+        if args.verbose:
+            colour_print([f"Input skipped, already completed: {arg_input}"], "R")
+        return True
+    return False
+
+
+def scan_directory(dir_path: str, rel_dir: str, sort: bool) -> typing.Tuple[str, str, list, list]:
+    """list a directory into folders and files, errors are ignored like os.walk"""
+    folders, files = [], []
+    try:
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    folders.append(entry)
+                else:
+                    files.append(entry)
+    except OSError:
+        pass
+    if sort:
+        folders.sort(key=lambda entry: entry.name)
+        files.sort(key=lambda entry: entry.name)
+    return dir_path, rel_dir, folders, files
+
+
+def walk_tree(args: argparse.Namespace) -> typing.Iterator[typing.Tuple[str, str, os.DirEntry]]:
+    """walk the directory tree like os.walk, but list subdirectories in parallel with a thread pool, yields (dir_path, relative dir prefix, entry) for each file or folder (with --folders)"""
+    import concurrent.futures
+    executor = concurrent.futures.ThreadPoolExecutor(args.walk_threads)
+    sort = not args.unsorted
+    # pruned directories are neither descended into nor yielded, other predicates are checked before yielding each entry
+    prune = glob_matcher(args.prune) if args.prune else None
+    keep = entry_filter(args)
+    pending = [executor.submit(scan_directory, args.base_dir, "", sort)]
+    try:
+        while pending:
+            if sort:
+                # depth first in sorted order, the same as os.walk, while the listings of subdirectories are prefetched
+                future = pending.pop()
             else:
-                # build commands from filenames or file paths
-                for file_name in sorted(file_list):
-                    command, arg_input, arg_input_split = build_command(args, dir_path, file_name, "", append_input)
-                    if command:
-                        command_dicts.append({"dir": dir_path, "cmd": command, "input": arg_input, "input_split": arg_input_split})
-                        command_dicts[0]["all_inputs"].append(arg_input)
-            if args.top_level:
-                break
-    return command_dicts
+                # yield each directory as soon as it has been listed
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                future = done.pop()
+                pending.remove(future)
+            dir_path, rel_dir, folders, files = future.result()
+            depth = rel_dir.count(os.sep) + 1
+            if prune is not None:
+                folders = [entry for entry in folders if not (prune(entry.name) or prune(rel_dir + entry.name))]
+            if depth >= args.min_depth:
+                entries = folders if args.folders else files
+                if args.entry_type == "l" and not args.folders:
+                    # like find, symlinks to directories are symlinks too, even though they are listed as folders
+                    entries = files + [entry for entry in folders if entry.is_symlink()]
+                    if sort:
+                        entries.sort(key=lambda entry: entry.name)
+                for entry in entries:
+                    if keep is None or keep(entry):
+                        yield dir_path, rel_dir, entry
+            if args.top_level or (args.max_depth is not None and depth >= args.max_depth):
+                continue
+            # like os.walk, symlinks to directories are listed but only followed with --symlinks
+            subdirectories = [executor.submit(scan_directory, entry.path, rel_dir + entry.name + os.sep, sort) for entry in folders if args.symlinks or not entry.is_symlink()]
+            pending.extend(reversed(subdirectories))
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
 
 
-def build_command(args: argparse.Namespace, dir_path: str, basename: str, arg_input: str, append_input: bool) -> typing.Tuple[list, str, typing.Union[list, tuple]]:
+def glob_matcher(patterns: list) -> typing.Callable[[str], typing.Optional[re.Match]]:
+    """compile glob patterns into a single regex and return its match function"""
+    import fnmatch
+    return re.compile("|".join(fnmatch.translate(pattern) for pattern in patterns)).match
+
+
+def entry_filter(args: argparse.Namespace) -> typing.Optional[typing.Callable[[os.DirEntry], bool]]:
+    """combine --include, --exclude, --type, --size, --mtime, and --newer into a predicate for each entry found by the walk, or None if none are used
+
+    the stat of each entry is cached by os.scandir on windows, otherwise it is only called once for all of the predicates that need it
+    """
+    checks = []
+    if args.include:
+        include = glob_matcher(args.include)
+        checks.append(lambda entry: include(entry.name) is not None)
+    if args.exclude:
+        exclude = glob_matcher(args.exclude)
+        checks.append(lambda entry: exclude(entry.name) is None)
+    if args.entry_type == "f":
+        checks.append(lambda entry: entry.is_file(follow_symlinks=False))
+    elif args.entry_type == "d":
+        checks.append(lambda entry: entry.is_dir(follow_symlinks=False))
+    elif args.entry_type == "l":
+        checks.append(lambda entry: entry.is_symlink())
+    bounds = []
+    if args.size is not None:
+        bounds.append((lambda stat: stat.st_size, *args.size))
+    if args.mtime is not None:
+        # like find, a number of days without a sign matches files modified that many whole days ago
+        now = time.time()
+        sign, days = args.mtime
+        bounds.append((lambda stat: (now - stat.st_mtime) / 86400 if sign else math.floor((now - stat.st_mtime) / 86400), sign, days))
+    if args.newer is not None:
+        bounds.append((lambda stat: stat.st_mtime_ns, "+", os.stat(args.newer).st_mtime_ns))
+    if bounds:
+        def check_bounds(entry: os.DirEntry) -> bool:
+            try:
+                stat = entry.stat()
+            except OSError:
+                return False
+            for value, sign, bound in bounds:
+                value = value(stat)
+                if not (value > bound if sign == "+" else value < bound if sign == "-" else value == bound):
+                    return False
+            return True
+        checks.append(check_bounds)
+    if not checks:
+        return None
+    return lambda entry: all(check(entry) for check in checks)
+
+
+def size_bound(value: str) -> typing.Tuple[str, int]:
+    """parse [+-]size for --size"""
+    sign = value[:1] if value[:1] in ("+", "-") else ""
+    return sign, parse_size(value[len(sign):])
+
+
+def days_bound(value: str) -> typing.Tuple[str, float]:
+    """parse [+-]days for --mtime"""
+    sign = value[:1] if value[:1] in ("+", "-") else ""
+    return sign, float(value[len(sign):])
+
+
+def select_input(args: argparse.Namespace, dir_path: str, basename: str, arg_input: str, relpath: str = "") -> typing.Optional[str]:
+    """return the input for the input mode, or None if it is omitted by regex"""
     # set arg_input based on mode (already set to correct value if stdin mode)
     if args.input_mode == "file":
         arg_input = basename
     elif args.input_mode == "path":
-        arg_input = os.path.join(dir_path, basename)
-        arg_input = os.path.relpath(arg_input, args.base_dir)
+        arg_input = relpath
     elif args.input_mode == "abspath":
         arg_input = os.path.join(dir_path, basename)
     # check whether to omit input based on regex
@@ -114,172 +502,1485 @@ def build_command(args: argparse.Namespace, dir_path: str, basename: str, arg_in
         if (re.search(args.regex_filter, arg_input) is not None) == args.regex_omit:
             if args.verbose:
                 colour_print([f"Input omitted by regex: {arg_input}"], "R")
-            return [], "", []
+            return None
     elif args.regex_basename:
         if (re.search(args.regex_filter, basename) is not None) == args.regex_omit:
             if args.verbose:
                 colour_print([f"Input omitted by regex: {arg_input}"], "R")
-            return [], "", []
+            return None
     else:
-        relpath = os.path.join(dir_path, basename)
-        relpath = os.path.relpath(relpath, args.base_dir)
         if (re.search(args.regex_filter, relpath) is not None) == args.regex_omit:
             if args.verbose:
                 colour_print([f"Input omitted by regex: {arg_input}"], "R")
-            return [], "", []
+            return None
+    return arg_input
+
+
+def split_input(args: argparse.Namespace, arg_input: str) -> typing.Union[list, tuple]:
+    """split the input with --split or --groups for formatting and the variable s"""
+    if args.re_split is not None:
+        return re.split(args.re_split, arg_input)
+    elif args.re_groups is not None:
+        return re.search(args.re_groups, arg_input).groups()
+    return [arg_input]
+
+
+def build_command(args: argparse.Namespace, arg_input: str, arg_input_split: typing.Union[list, tuple, None] = None) -> list:
     # copy command first since some options mutate it
     command = args.command.copy()
     # re.sub input into command
     if args.resub is not None:
         command = [cmd.replace(args.resub[2], re.sub(args.resub[0], args.resub[1], arg_input)) for cmd in command]
     # build command with input via format, append, or replace-str
-    arg_input_split = [arg_input]
     if args.format_str:
-        if args.re_split is not None:
-            arg_input_split = re.split(args.re_split, arg_input)
-        elif args.re_groups is not None:
-            arg_input_split = re.search(args.re_groups, arg_input).groups()
+        if arg_input_split is None:
+            arg_input_split = split_input(args, arg_input)
         command = [cmd.format(*arg_input_split) for cmd in command]
-    elif append_input:
+    elif args.append_input:
         command.append(arg_input)
     else:
         command = [cmd.replace(args.replace_str, arg_input) for cmd in command]
-    # check length of command
-    if args.max_chars is not None:
-        if len(shlex.join(command)) > args.max_chars:
-            if args.verbose:
-                colour_print([f"Command too long for: {arg_input}"], "R")
-            return [], "", []
-    # join command if required, shlex required for shell, extra escaped quotes can be problematic for python
+    return command
+
+
+def build_batch_command(args: argparse.Namespace, batch: list) -> list:
+    """build a command with each argument equal to replace-str (or the end of the command) replaced by the batch of inputs"""
+    template = args.command + [args.replace_str] if args.append_input else args.command
+    command = []
+    for part in template:
+        if part == args.replace_str:
+            command.extend(batch)
+        else:
+            command.append(part)
+    return command
+
+
+def command_line(args: argparse.Namespace, command: Command, arg_input_split: typing.Union[list, tuple, None] = None) -> list:
+    """build the final command line when it is about to run, so only the input needs to be stored beforehand"""
+    if command.batch is not None and args.max_args is not None:
+        return join_command(args, build_batch_command(args, command.batch))
+    return join_command(args, build_command(args, command.input, arg_input_split))
+
+
+def join_command(args: argparse.Namespace, command: list) -> list:
+    """join command if required, shlex required for shell, extra escaped quotes can be problematic for python"""
     if len(command) > 1:
         if args.pyex or args.pyev or args.pyprt or args.sql:
             command = [" ".join(command)]
         elif args.subprocess_shell:
             command = [shlex.join(command)]
-    return command, arg_input, arg_input_split
+    return command
 
 
-def execute_commands(args: argparse.Namespace, command_dicts: list) -> int:
+def system_arg_max(args: argparse.Namespace) -> int:
+    """maximum length of a command line for a new process after accounting for the environment (like xargs --show-limits)"""
+    if sys.platform.startswith("win32"):
+        # CreateProcess limits the entire command line to 32767 characters
+        return 32767 - 2048
+    pointer_size = 8
+    env_size = sum(len(os.fsencode(key)) + len(os.fsencode(value)) + 2 + pointer_size for key, value in os.environ.items())
+    arg_max = os.sysconf("SC_ARG_MAX") - env_size - 2048
+    if args.subprocess_shell and sys.platform.startswith("linux"):
+        # the shell command is a single argument, which linux limits to 32 pages (MAX_ARG_STRLEN)
+        arg_max = min(arg_max, 131072 - 1)
+    return arg_max
+
+
+def pack_commands(args: argparse.Namespace, commands: typing.Iterable[Command]) -> typing.Iterator[Command]:
+    """check the length of each command, with --max-args the inputs of consecutive commands are packed into as few command lines as possible (like xargs)"""
+    if args.max_args is None:
+        for command in commands:
+            if args.max_chars is not None and len(shlex.join(build_command(args, command.input))) > args.max_chars:
+                if args.verbose:
+                    colour_print([f"Command too long for: {command.input}"], "R")
+                continue
+            yield command
+        return
+    # measure arguments as they would be joined by shlex for --max-chars or --sh, or as they are passed to exec otherwise
+    if args.max_chars is not None:
+        limit = args.max_chars + 1
+        measure = lambda part: len(shlex.quote(part)) + 1
+    elif args.subprocess_shell:
+        # quoting can make an input several times longer, such as each ' becoming '"'"'
+        limit = system_arg_max(args)
+        measure = lambda part: len(os.fsencode(shlex.quote(part))) + 1
+    else:
+        limit = system_arg_max(args)
+        measure = lambda part: len(os.fsencode(part)) + 1 + 8
+    template = args.command + [args.replace_str] if args.append_input else args.command
+    placeholders = template.count(args.replace_str)
+    base_length = sum(measure(part) for part in template if part != args.replace_str)
+    max_args = args.max_args if args.max_args > 0 else float("inf")
+    batch, batch_dir, batch_states, batch_sizes, length = [], None, [], [], base_length
+
+    def build_batch() -> Command:
+        return Command(batch_dir, " ".join(batch), batch, batch_states if incremental_cache is not None else None, sum(batch_sizes) if args.order == "size-desc" and None not in batch_sizes else None)
+
+    for command in commands:
+        arg_input = command.input
+        input_length = measure(arg_input) * placeholders
+        if base_length + input_length > limit:
+            if args.verbose:
+                colour_print([f"Command too long for: {arg_input}"], "R")
+            continue
+        # commands are only packed together if they are executed in the same directory
+        if batch and (len(batch) >= max_args or length + input_length > limit or command.dir != batch_dir):
+            yield build_batch()
+            batch, batch_states, batch_sizes, length = [], [], [], base_length
+        batch.append(arg_input)
+        batch_states.append(command.state)
+        batch_sizes.append(command.size)
+        batch_dir = command.dir
+        length += input_length
+    if batch:
+        yield build_batch()
+
+
+def execute_commands(args: argparse.Namespace, commands: typing.Iterable[Command]) -> int:
     user_namespace = {}
-    # pop special first entry from command_dicts, not supported with multiple processes
-    if "all_inputs" in command_dicts[0]:
-        all_inputs = command_dicts.pop(0)["all_inputs"]
-    if args.procs is not None:
-        all_inputs = ["ERROR: var not available with --procs"] * len(command_dicts)
     # loop variables available to the user
     global i, j, n, a, out
     i = -1
-    n = len(command_dicts)
-    j = n
-    a = all_inputs
-    out = []
-    # pre execution tasks (add system packages in case of pipx or venv, safe to add duplicate or non-existent paths)
-    site.addsitedir("/usr/lib/python3/dist-packages")
-    site.addsitedir(os.path.expanduser(f"~/.local/lib/python{sys.version_info.major}.{sys.version_info.minor}/site-packages"))
-    site.addsitedir(os.path.expandvars(f"$CONDA_PREFIX/lib/python{sys.version_info.major}.{sys.version_info.minor}/site-packages"))
+    # previous results, optionally only the most recent
+    out = collections.deque(maxlen=args.out_maxlen) if args.out_maxlen is not None else []
+    if args.stream or args.jsonl:
+        # commands are generated as input arrives, or records are streamed, so the total is unknown
+        n = j = a = f"ERROR: var not available with {'--stream' if args.stream else '--jsonl'}"
+    else:
+        # all inputs are not available with multiple processes
+        if args.procs is not None:
+            a = ["ERROR: var not available with --procs"] * len(commands)
+        else:
+            a = InputView(commands)
+        n = len(commands)
+        j = n
+    # pre execution tasks, with --no-mux or --serve each worker process runs them instead
+    in_workers = args.no_mux or args.serve is not None
+    if not in_workers:
+        with timed_phase("prepare"):
+            prepare_namespace(args, user_namespace)
+    # execute commands
+    global joblog, throttle, result_sink
+    joblog = JobLog(args.joblog) if args.joblog is not None else None
+    result_sink = open_results(args.results) if args.results is not None else None
+    throttle = Throttle(args, args.jobs or args.procs or 1) if args.load_max is not None or args.mem_free is not None or args.psi_max is not None or args.delay else None
+    status = 0
+    if stats is not None:
+        # the number of commands that can run at once, each chunk of --procs started with a multiplexer reports its own statistics
+        stats.slots = args.jobs or ((args.procs or 0) + len(args.ssh) if args.serve is not None else args.procs if args.no_mux else None) or 1
+    if stats is not None and args.progress:
+        stats.start_progress(None if args.stream else n)
+    try:
+        with timed_phase("execute"):
+            if args.interactive:
+                for command in commands:
+                    colour_print(command_line(args, command), "G")
+                    print("Run command (Yes/NO/Quit)?")
+                    run = input("> ")
+                    if run.lower().startswith("y"):
+                        returncode, start, duration = run_timed(execute_command, args, command, user_namespace)
+                        record_job(args, command, returncode, start, duration)
+                        status = combine_status(status, returncode)
+                    elif run.lower().startswith("q"):
+                        return 4
+                    else:
+                        # default to no, update loop variables since execute_command was skipped
+                        i += 1
+                        if not args.stream:
+                            j -= 1
+            elif args.vector:
+                status = execute_vector(args, commands, user_namespace)
+            elif args.serve is not None:
+                status = execute_serve(args, commands)
+            elif args.no_mux:
+                status = execute_pool(args, commands)
+            elif args.jobs is not None:
+                status = execute_jobs(args, commands, user_namespace)
+            else:
+                # with --jsonl each command is a source of records instead of a single input
+                execute = execute_jsonl if args.jsonl else execute_command
+                for command in commands:
+                    if throttle is not None:
+                        throttle.pace()
+                    returncode, start, duration = run_timed(execute, args, command, user_namespace)
+                    record_job(args, command, returncode, start, duration)
+                    status = combine_status(status, returncode)
+    finally:
+        if stats is not None and args.progress:
+            stats.stop_progress()
+        if joblog is not None:
+            joblog.close()
+        if result_sink is not None:
+            result_sink.close()
+    # post execution tasks
+    if args.post:
+        with timed_phase("post"):
+            if in_workers:
+                # libraries are still available to --post, but --pre only ran in the workers
+                import_libraries(args, user_namespace)
+            exec(args.post, globals(), user_namespace)
+    if stats is not None:
+        stats.report(args)
+    # only the parallel runners report the combined exit status, running in order still exits 0 as it always has
+    return status if args.jobs is not None or args.serve is not None else 0
+
+
+def prepare_namespace(args: argparse.Namespace, user_namespace: dict) -> None:
+    """import libraries and run --pre, once per process"""
+    # find system packages in case of pipx or venv, their site-packages are only added if an import fails
+    if SitedirFinder not in sys.meta_path:
+        sys.meta_path.append(SitedirFinder)
     if args.dataframe:
         global pd
         import pandas as pd
     if args.sql:
-        global duckdb, conn
+        global duckdb, conn, sql_database, sql_attached
         import duckdb
+        # a single connection is used for every input, databases are attached to it instead of opening a new connection
         conn = duckdb.connect(":default:")
+        sql_database = conn.sql("SELECT current_database()").fetchone()[0]
+        sql_attached = False
+    import_libraries(args, user_namespace)
+    if args.pre:
+        exec(args.pre, globals(), user_namespace)
+
+
+def import_libraries(args: argparse.Namespace, user_namespace: dict) -> None:
+    """import libraries for --import and --im"""
     for lib in args.imprt:
         exec(f"import {lib}", globals(), user_namespace)
     for lib in args.imprtstar:
         exec(f"from {lib} import *", globals(), user_namespace)
-    if args.pre:
-        exec(args.pre, globals(), user_namespace)
-    # execute commands
-    if args.interactive:
-        for command_dict in command_dicts:
-            colour_print(command_dict["cmd"], "G")
-            print("Run command (Yes/NO/Quit)?")
-            run = input("> ")
-            if run.lower().startswith("y"):
-                execute_command(args, command_dict, user_namespace)
-            elif run.lower().startswith("q"):
-                return 4
-            else:
-                # default to no, update loop variables since execute_command was skipped
-                i, j = i + 1, j - 1
-    elif args.no_mux:
-        with multiprocessing.Pool(args.procs) as pool:
-            pool.starmap(execute_command, [(args, command_dict, user_namespace) for command_dict in command_dicts])
+
+
+class SitedirFinder:
+    """last resort import finder that adds the system and user site-packages to the path the first time a module is not found, then searches again
+
+    scanning their .pth files is slow, so this is only done once and only if needed, directories that do not exist or are already on the path are skipped
+    """
+
+    @classmethod
+    def find_spec(cls, name: str, path: typing.Optional[list] = None, target: typing.Any = None) -> typing.Any:
+        import importlib.machinery
+        import site
+        sys.meta_path.remove(cls)
+        version = f"python{sys.version_info.major}.{sys.version_info.minor}"
+        sitedirs = ["/usr/lib/python3/dist-packages", os.path.expanduser(f"~/.local/lib/{version}/site-packages")]
+        if "CONDA_PREFIX" in os.environ:
+            sitedirs.append(os.path.join(os.environ["CONDA_PREFIX"], "lib", version, "site-packages"))
+        for sitedir in sitedirs:
+            if sitedir not in sys.path and os.path.isdir(sitedir):
+                site.addsitedir(sitedir)
+        return importlib.machinery.PathFinder.find_spec(name, path, target)
+
+
+def execute_pool(args: argparse.Namespace, commands: typing.Iterable[Command]) -> int:
+    """distribute commands to a pool of worker processes as they become free, and collect their exit status, results, and output"""
+    import multiprocessing
+    import threading
+    global i, j, parts
+    status = 0
+    chunksize = args.chunksize
+    if chunksize is None:
+        # send inputs in batches to reduce overhead, while still giving each worker several batches to balance the load
+        chunksize = 1 if args.stream or throttle is not None else max(1, min(256, n // (args.procs * 8)))
+    # the pool consumes tasks in a separate thread, limit how far it reads ahead of the workers so input is streamed
+    slots = threading.Semaphore(args.procs * chunksize * 4)
+    finished = 0
+
+    def tasks() -> typing.Iterator[tuple]:
+        for index, command in enumerate(commands):
+            slots.acquire()
+            if throttle is not None:
+                throttle.wait(lambda: index - finished)
+            yield index, command
+
+    # every worker waits at the barrier before running --post-worker, so each one gets exactly one of these tasks
+    barrier = multiprocessing.Barrier(args.procs) if args.post_worker else None
+    with multiprocessing.Pool(args.procs, init_worker, (args, n, a, barrier)) as pool:
+        pool_map = pool.imap if args.keep_order else pool.imap_unordered
+        for command, returncode, start, duration, results, stdout, stderr in pool_map(execute_task, tasks(), chunksize):
+            slots.release()
+            finished += 1
+            record_job(args, command, returncode, start, duration, (stdout, stderr) if args.results_output else None)
+            i += 1
+            if not args.stream:
+                j -= 1
+            out.extend(results)
+            if args.group:
+                write_output(args, command.input, io.BytesIO(stdout), io.BytesIO(stderr))
+            status = combine_status(status, returncode)
+        if args.post_worker:
+            parts = pool.map(finish_worker, range(args.procs), 1)
+    return status
+
+
+def init_worker(args: argparse.Namespace, total: typing.Union[int, str], all_inputs: typing.Union[list, str], barrier: typing.Any) -> None:
+    """initialize a pool worker once with the arguments, loop variables, imports, and --pre"""
+    global worker_args, worker_namespace, worker_barrier, n, a, out
+    worker_args, worker_namespace, worker_barrier = args, {}, barrier
+    n, a, out = total, all_inputs, []
+    prepare_namespace(worker_args, worker_namespace)
+
+
+def finish_worker(_: int) -> typing.Any:
+    """evaluate --post-worker in a pool worker after its last command and return the result to the parent for --post"""
+    import pickle
+    worker_barrier.wait()
+    result = eval(worker_args.post_worker, globals(), worker_namespace)
+    sys.stdout.flush()
+    try:
+        pickle.dumps(result)
+        return result
+    except Exception:
+        return str(result)
+
+
+def execute_task(task: tuple) -> typing.Tuple[dict, typing.Optional[int], float, float, list, bytes, bytes]:
+    """execute a command in a pool worker and return its exit status, start time, duration, results, and output if captured"""
+    import pickle
+    import tempfile
+    global i, j
+    index, command = task
+    # set the loop variables from the global index since execute_command increments them
+    i = index - 1
+    if not worker_args.stream:
+        j = n - index
+    if worker_args.group:
+        output = (tempfile.SpooledTemporaryFile(OUTPUT_SPOOL_SIZE), tempfile.SpooledTemporaryFile(OUTPUT_SPOOL_SIZE))
+        stdout, stderr = io.TextIOWrapper(output[0], write_through=True), io.TextIOWrapper(output[1], write_through=True)
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            returncode, start, duration = run_timed(execute_command, worker_args, command, worker_namespace, output)
+        stdout.detach()
+        stderr.detach()
+        for buffer in output:
+            buffer.seek(0)
+        stdout, stderr = output[0].read(), output[1].read()
     else:
-        for command_dict in command_dicts:
-            execute_command(args, command_dict, user_namespace)
-    # post execution tasks
-    if args.post:
-        exec(args.post, globals(), user_namespace)
+        returncode, start, duration = run_timed(execute_command, worker_args, command, worker_namespace)
+        sys.stdout.flush()
+        stdout = stderr = b""
+    # send results back to the parent for out and --post, as strings if they can not be pickled
+    results = []
+    for result in out:
+        try:
+            pickle.dumps(result)
+            results.append(result)
+        except Exception:
+            results.append(str(result))
+    out.clear()
+    return command, returncode, start, duration, results, stdout, stderr
+
+
+def execute_serve(args: argparse.Namespace, commands: typing.Sequence[Command]) -> int:
+    """serve commands over TCP to workers started with --worker, then record their results as they are acknowledged
+
+    each message is a line of json, workers send the results of their previous lease and receive a new lease of commands or done,
+    leases get smaller as fewer commands remain, and the commands leased to a worker that disconnects or stops sending heartbeats
+    are handed out again, workers must first send the token from PYXARGS_TOKEN (or a random one given to the workers started here)
+    before they are sent anything, and only results for commands leased to the same connection are recorded
+    """
+    import hmac
+    import json
+    import queue
+    import socket
+    import socketserver
+    import secrets
+    import subprocess
+    import threading
+    global i, j
+    token = os.environ.get("PYXARGS_TOKEN") or secrets.token_hex(16)
+    pending = collections.deque(range(len(commands)))
+    results = queue.Queue()
+    condition = threading.Condition()
+    connections = 0
+    done = False
+    # workers run with the same options, except those that are handled here
+    config = json.dumps({"args": dict(vars(args), serve=None, ssh=[], joblog=None, stats=None, progress=False, profile=None, incremental=None), "n": n}) + "\n"
+
+    def take() -> list:
+        with condition:
+            while not pending and not done:
+                condition.wait()
+            size = args.chunksize if args.chunksize is not None else max(1, min(256, len(pending) // (8 * connections)))
+            return [pending.popleft() for _ in range(min(size, len(pending)))]
+
+    class WorkerHandler(socketserver.StreamRequestHandler):
+        # reading from a worker that has not sent a heartbeat in time raises socket.timeout (an OSError), so a host that disappears
+        # without closing the connection does not keep its lease forever
+        timeout = SERVE_TIMEOUT
+
+        def handle(self) -> None:
+            nonlocal connections
+            try:
+                hello = json.loads(self.rfile.readline())
+            except (OSError, ValueError):
+                return
+            if not isinstance(hello, dict) or not hmac.compare_digest(str(hello.get("token")).encode(), token.encode()):
+                return
+            leased = set()
+            with condition:
+                connections += 1
+            try:
+                self.wfile.write(config.encode())
+                self.wfile.flush()
+                for line in self.rfile:
+                    message = json.loads(line)
+                    if "results" not in message:
+                        # heartbeat while the worker runs its lease
+                        continue
+                    for result in message["results"]:
+                        # results for commands that were not leased to this worker would otherwise be recorded as completed
+                        if result[0] in leased:
+                            leased.discard(result[0])
+                            results.put(result)
+                    lease = take()
+                    if not lease:
+                        self.wfile.write(b'{"done": true}\n')
+                        self.wfile.flush()
+                        break
+                    leased.update(lease)
+                    lease = [[index, commands[index].dir, commands[index].input, commands[index].batch] for index in lease]
+                    self.wfile.write((json.dumps({"lease": lease}) + "\n").encode())
+                    self.wfile.flush()
+            except (OSError, ValueError):
+                pass
+            finally:
+                with condition:
+                    connections -= 1
+                    pending.extendleft(sorted(leased, reverse=True))
+                    condition.notify_all()
+
+    host, _, port = args.serve.rpartition(":")
+    server = socketserver.ThreadingTCPServer((host or "localhost", int(port)), WorkerHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    address, port = server.server_address[:2]
+    print(f"Serving {n} commands on {address}:{port}" + ("" if "PYXARGS_TOKEN" in os.environ else f", start other workers with PYXARGS_TOKEN={token}"), file=sys.stderr)
+    # start local workers and workers on each host with ssh, which connect back to this host if listening on all interfaces
+    wildcard = address in ["0.0.0.0", "::"]
+    workers = [subprocess.Popen([sys.executable, os.path.abspath(__file__), "--worker", f"{'localhost' if wildcard else address}:{port}"], stdin=subprocess.DEVNULL, env=dict(os.environ, PYXARGS_TOKEN=token))
+               for _ in range(args.procs or 0)]
+    # the token is sent to workers on other hosts through stdin, so it is not visible in their command line
+    for host in args.ssh:
+        workers.append(subprocess.Popen(["ssh", host, "pyxargs", "--worker", f"{socket.getfqdn() if wildcard else address}:{port}"], stdin=subprocess.PIPE))
+        workers[-1].stdin.write(token.encode() + b"\n")
+        workers[-1].stdin.close()
+    status = 0
+    try:
+        for _ in range(len(commands)):
+            while True:
+                try:
+                    index, returncode, start, duration, result, stdout, stderr, rss = results.get(timeout=PROGRESS_INTERVAL)
+                    break
+                except queue.Empty:
+                    if workers and connections == 0 and all(worker.poll() is not None for worker in workers):
+                        print("Error: all workers exited before every command was run", file=sys.stderr)
+                        return 1
+            stdout, stderr = stdout.encode("utf-8", "surrogateescape"), stderr.encode("utf-8", "surrogateescape")
+            commands[index].rss = rss
+            record_job(args, commands[index], returncode, start, duration, (stdout, stderr) if args.results_output else None)
+            i += 1
+            j -= 1
+            out.extend(result)
+            if args.group:
+                write_output(args, commands[index].input, io.BytesIO(stdout), io.BytesIO(stderr))
+            status = combine_status(status, returncode)
+    finally:
+        with condition:
+            done = True
+            condition.notify_all()
+        for worker in workers:
+            worker.wait()
+        server.shutdown()
+        server.server_close()
+    return status
+
+
+def run_worker(args: argparse.Namespace) -> int:
+    """connect to a --serve coordinator and run the commands it leases with its options until they are done"""
+    import json
+    import socket
+    import threading
+    token = os.environ.get("PYXARGS_TOKEN")
+    if token is None:
+        # workers started with --ssh get the token through stdin
+        if sys.stdin.isatty():
+            import getpass
+            token = getpass.getpass("PYXARGS_TOKEN: ")
+        else:
+            token = sys.stdin.readline().strip()
+    host, _, port = args.worker.rpartition(":")
+    with socket.create_connection((host, int(port))) as sock:
+        rfile, wfile = sock.makefile("rb"), sock.makefile("wb")
+        lock = threading.Lock()
+        stop = threading.Event()
+
+        def send(message: dict) -> None:
+            with lock:
+                wfile.write((json.dumps(message) + "\n").encode())
+                wfile.flush()
+
+        def heartbeat() -> None:
+            while not stop.wait(SERVE_HEARTBEAT):
+                try:
+                    send({"heartbeat": True})
+                except (OSError, ValueError):
+                    return
+
+        send({"token": token})
+        config = rfile.readline()
+        if not config:
+            print("Error: connection closed by coordinator, check PYXARGS_TOKEN", file=sys.stderr)
+            return 1
+        config = json.loads(config)
+        # heartbeats start before --pre runs, which may take a while
+        threading.Thread(target=heartbeat, daemon=True).start()
+        try:
+            worker = argparse.Namespace(**config["args"])
+            # inputs from stdin are run in the current directory, file paths are expected to be the same as on the coordinator
+            worker.base_dir = os.getcwd()
+            init_worker(worker, config["n"], "ERROR: var not available with --serve", None)
+            results = []
+            while True:
+                send({"results": results})
+                message = rfile.readline()
+                if not message:
+                    print("Error: lost connection to coordinator", file=sys.stderr)
+                    return 1
+                message = json.loads(message)
+                if "lease" not in message:
+                    return 0
+                results = []
+                for index, dir_path, arg_input, batch in message["lease"]:
+                    command = Command(worker.base_dir if worker.input_mode == "stdin" else dir_path, arg_input, batch)
+                    command, returncode, start, duration, result, stdout, stderr = execute_task((index, command))
+                    # results that can not be sent as json are sent as strings
+                    for k, value in enumerate(result):
+                        try:
+                            json.dumps(value)
+                        except Exception:
+                            result[k] = str(value)
+                    results.append([index, returncode, start, duration, result, stdout.decode("utf-8", "surrogateescape"), stderr.decode("utf-8", "surrogateescape"), command.rss])
+        finally:
+            stop.set()
+
+
+def execute_jobs(args: argparse.Namespace, commands: typing.Iterable[Command], user_namespace: dict) -> int:
+    """keep up to args.jobs subprocesses running at once from this process (like xargs -P), commands are prepared sequentially"""
+    import concurrent.futures
+    import tempfile
+    status = 0
+    running = set()
+    # jobs in input order with their captured output, bounded so finished output is not held indefinitely behind a slow job
+    ordered = collections.deque()
+    backlog = args.jobs * 4
+    with concurrent.futures.ThreadPoolExecutor(args.jobs) as executor:
+        for command in commands:
+            cmd = prepare_command(args, command, user_namespace)
+            if cmd is None:
+                continue
+            # wait for a free slot before starting the next subprocess so input is only consumed as needed
+            while True:
+                if args.keep_order:
+                    while ordered and ordered[0][1].done():
+                        status = combine_status(status, finish_job(args, *ordered.popleft()))
+                    if len(ordered) >= backlog:
+                        concurrent.futures.wait([ordered[0][1]])
+                        continue
+                if len(running) < (args.jobs if throttle is None else throttle.update()):
+                    break
+                # check the throttle again after its interval even if no job has finished
+                timeout = None if throttle is None else throttle.interval
+                done, running = concurrent.futures.wait(running, timeout, concurrent.futures.FIRST_COMPLETED)
+                if not args.keep_order:
+                    for future in done:
+                        status = combine_status(status, finish_job(args, *future.job))
+            if throttle is not None:
+                throttle.pace()
+            output = (tempfile.SpooledTemporaryFile(OUTPUT_SPOOL_SIZE), tempfile.SpooledTemporaryFile(OUTPUT_SPOOL_SIZE)) if args.group else None
+            future = executor.submit(run_timed, run_subprocess, args, cmd, command, output)
+            future.job = (command, future, output)
+            running.add(future)
+            if args.keep_order:
+                ordered.append(future.job)
+        if args.keep_order:
+            for job in ordered:
+                status = combine_status(status, finish_job(args, *job))
+        else:
+            for future in concurrent.futures.as_completed(running):
+                status = combine_status(status, finish_job(args, *future.job))
+    return status
+
+
+def finish_job(args: argparse.Namespace, command: Command, future: "concurrent.futures.Future", output: typing.Optional[tuple]) -> int:
+    """wait for a job to finish and write its captured output, if any, then return its exit status"""
+    returncode, start, duration = future.result()
+    captured = None
+    if output is not None:
+        if args.results_output:
+            captured = []
+            for buffer in output:
+                buffer.seek(0)
+                captured.append(buffer.read())
+                buffer.close()
+            output = (io.BytesIO(captured[0]), io.BytesIO(captured[1]))
+        write_output(args, command.input, *output)
+    record_job(args, command, returncode, start, duration, captured)
+    return returncode
+
+
+def write_output(args: argparse.Namespace, arg_input: str, stdout: typing.BinaryIO, stderr: typing.BinaryIO) -> None:
+    """write the captured output of a command all at once, optionally prefixing each line with its input"""
+    import shutil
+    sys.stdout.flush()
+    sys.stderr.flush()
+    for source, destination in ((stdout, sys.stdout.buffer), (stderr, sys.stderr.buffer)):
+        source.seek(0)
+        if args.tag:
+            tag = arg_input.encode(sys.stdout.encoding or "utf-8", "surrogateescape") + b"\t"
+            for line in source:
+                destination.write(tag + line)
+        else:
+            shutil.copyfileobj(source, destination)
+        destination.flush()
+        source.close()
+
+
+class ClaimQueue:
+    """commands shared by the chunks started with a multiplexer, which each take the next command as soon as they are free
+
+    the pickle file starts with a counter of claimed commands, which is read and incremented while holding an exclusive lock,
+    the number of commands taken by this chunk is shown in the window name with tmux
+    """
+    HEADER_SIZE = 8
+
+    def __init__(self, args: argparse.Namespace, path: str) -> None:
+        import pickle
+        self.args = args
+        self.fd = os.open(path, os.O_RDWR)
+        with open(path, "rb") as fd:
+            fd.seek(self.HEADER_SIZE)
+            self.commands = pickle.load(fd)
+        self.taken = 0
+        self.last_status = 0.0
+
+    def __len__(self) -> int:
+        return len(self.commands)
+
+    def __iter__(self) -> typing.Iterator[Command]:
+        global i, j
+        try:
+            while True:
+                index = self.claim()
+                if index >= len(self.commands):
+                    break
+                self.taken += 1
+                self.update_status()
+                # set the loop variables from the claimed index since execute_command increments them
+                i = index - 1
+                j = len(self.commands) - index
+                yield self.commands[index]
+        finally:
+            self.update_status(force=True)
+
+    def claim(self) -> int:
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            index = int.from_bytes(os.pread(self.fd, self.HEADER_SIZE, 0), "little")
+            os.pwrite(self.fd, (index + 1).to_bytes(self.HEADER_SIZE, "little"), 0)
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        return index
+
+    def update_status(self, force: bool = False) -> None:
+        """rename this window at most every PROGRESS_INTERVAL seconds"""
+        if "TMUX_PANE" not in os.environ or not (force or time.monotonic() - self.last_status >= PROGRESS_INTERVAL):
+            return
+        import subprocess
+        self.last_status = time.monotonic()
+        subprocess.run(["tmux", "rename-window", "-t", os.environ["TMUX_PANE"], f"{self.args.chunk}: {self.taken} taken"],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def run_timed(function: typing.Callable, *params) -> typing.Tuple[typing.Any, float, float]:
+    """call function and return its result, start time, and duration"""
+    start, counter = time.time(), time.perf_counter()
+    return function(*params), start, time.perf_counter() - counter
+
+
+def job_key(args: argparse.Namespace, dir_path: str, arg_input: str) -> str:
+    """identify an input for the job log, filenames are only unique with their directory"""
+    return os.path.join(dir_path, arg_input) if args.input_mode == "file" else arg_input
+
+
+def record_job(args: argparse.Namespace, command: Command, returncode: typing.Optional[int], start: float, duration: float, output: typing.Optional[tuple] = None) -> None:
+    """record each input of a completed command in the job log, incremental cache, and statistics, and the command in the results with its captured output, commands that were not run are not recorded (except in statistics)"""
+    if stats is not None:
+        stats.record(command, returncode, start, duration)
+    if result_sink is not None and returncode is not None:
+        result_sink.record(result_record(args, command, returncode, start, duration, output))
+    if joblog is not None and returncode is not None:
+        for arg_input in command.batch if command.batch is not None else (command.input,):
+            joblog.record(job_key(args, command.dir, arg_input), returncode, start, duration)
+    if incremental_cache is not None and returncode == 0:
+        for file_state in command.state if command.batch is not None else (command.state,):
+            if file_state is not None:
+                incremental_cache.record(file_state)
+
+
+class JobLog:
+    """append-only log of completed inputs (tab separated start time, duration, exit status, and json encoded input)
+
+    lines are buffered and appended with a single write followed by fsync at most every flush_interval seconds,
+    with an exclusive lock so multiple processes (such as --procs chunks) can safely append to the same file
+    """
+    HEADER = "Starttime\tJobRuntime\tExitval\tInput\n"
+
+    def __init__(self, path: str, flush_interval: float = 1.0, max_lines: int = 10000) -> None:
+        import threading
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self.flush_interval = flush_interval
+        self.max_lines = max_lines
+        self.lines = []
+        self.last_flush = time.monotonic()
+        self.lock = threading.Lock()
+
+    def record(self, key: str, returncode: int, start: float, duration: float) -> None:
+        import json
+        self.append(f"{start:.3f}\t{duration:.3f}\t{returncode}\t{json.dumps(key)}\n")
+
+    def append(self, line: str) -> None:
+        with self.lock:
+            self.lines.append(line)
+            if len(self.lines) >= self.max_lines or time.monotonic() - self.last_flush >= self.flush_interval:
+                self.flush()
+
+    def flush(self) -> None:
+        data = "".join(self.lines).encode()
+        self.lines = []
+        self.last_flush = time.monotonic()
+        locking = not sys.platform.startswith("win32")
+        if locking:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self.fd).st_size == 0:
+                data = self.HEADER.encode() + data
+            self.write(data)
+            os.fsync(self.fd)
+        finally:
+            if locking:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def write(self, data: bytes) -> None:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self.fd, view):]
+
+    def close(self) -> None:
+        with self.lock:
+            self.flush()
+        os.close(self.fd)
+
+
+class ResultLog(JobLog):
+    """append-only json lines of the result of each command numbered in the order they completed, buffered and locked the same as the job log"""
+    HEADER = ""
+    seq = 0
+
+    def record(self, record: dict) -> None:
+        import json
+        self.seq += 1
+        self.append(json.dumps({"seq": self.seq, **record}) + "\n")
+
+
+class ResultDatabase:
+    """sqlite table of the result of each command numbered in the order they completed, inserted in batched transactions"""
+    SCHEMA = "CREATE TABLE IF NOT EXISTS results (seq INTEGER, input TEXT, command TEXT, exit INTEGER, start REAL, duration REAL, maxrss INTEGER, stdout TEXT, stderr TEXT)"
+    FIELDS = ("input", "command", "exit", "start", "duration", "maxrss", "stdout", "stderr")
+    seq = 0
+
+    def __init__(self, path: str, flush_interval: float = 1.0, batch_size: int = 10000) -> None:
+        import sqlite3
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(self.SCHEMA)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.rows = []
+        self.last_flush = time.monotonic()
+
+    def record(self, record: dict) -> None:
+        self.seq += 1
+        # sqlite can not encode the surrogates used for undecodable bytes in file names
+        self.rows.append((self.seq,) + tuple(replace_surrogates(record[field]) if isinstance(record.get(field), str) else record.get(field) for field in self.FIELDS))
+        if len(self.rows) >= self.batch_size or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        with self.conn:
+            self.conn.executemany("INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", self.rows)
+        self.rows = []
+        self.last_flush = time.monotonic()
+
+    def close(self) -> None:
+        self.flush()
+        self.conn.close()
+
+
+def open_results(path: str) -> typing.Union[ResultLog, ResultDatabase]:
+    """open --results as a sqlite database by its extension, otherwise as json lines"""
+    if os.path.splitext(path)[1].lower() in [".db", ".sqlite", ".sqlite3"]:
+        return ResultDatabase(path)
+    return ResultLog(path)
+
+
+def result_record(args: argparse.Namespace, command: Command, returncode: int, start: float, duration: float, output: typing.Optional[tuple]) -> dict:
+    """the result of a command for --results, with its captured output if any"""
+    cmd = command_line(args, command)
+    record = {"input": command.input, "command": cmd[0] if len(cmd) == 1 else shlex.join(cmd),
+              "exit": returncode, "start": round(start, 3), "duration": round(duration, 6), "maxrss": command.rss}
+    if output is not None:
+        record["stdout"], record["stderr"] = (data.decode("utf-8", "replace") for data in output)
+    return record
+
+
+def peak_rss(usage: typing.Any) -> int:
+    """the peak resident set size from resource usage in bytes (kilobytes on linux, bytes on macos)"""
+    return usage.ru_maxrss if sys.platform.startswith("darwin") else usage.ru_maxrss * 1024
+
+
+def wait_usage(pid: int) -> typing.Tuple[int, int]:
+    """wait for a child process with wait4 and return its exit status (negative signal number if killed) and peak rss"""
+    _, status, usage = os.wait4(pid, 0)
+    returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+    return returncode, peak_rss(usage)
+
+
+class IncrementalCache:
+    """sqlite index of the state (mtime_ns, size, inode, and optionally sha256) of files when a command last succeeded for them
+
+    rows are keyed by a hash of the command template and the absolute path, updates are written in batched transactions,
+    and rows for paths not seen by a complete walk (deleted or no longer matched) are evicted when the cache is closed
+    """
+    SCHEMA = ("CREATE TABLE IF NOT EXISTS files (template TEXT, path TEXT, mtime_ns INTEGER, size INTEGER, inode INTEGER, digest TEXT, seen INTEGER, "
+              "PRIMARY KEY (template, path)) WITHOUT ROWID")
+
+    def __init__(self, args: argparse.Namespace, batch_size: int = 1000) -> None:
+        import sqlite3
+        import threading
+        os.makedirs(os.path.dirname(os.path.abspath(args.incremental)), exist_ok=True)
+        self.conn = sqlite3.connect(args.incremental, timeout=60, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(self.SCHEMA)
+        self.template = command_template_hash(args)
+        self.run = self.conn.execute("SELECT COALESCE(MAX(seen), 0) + 1 FROM files WHERE template = ?", (self.template,)).fetchone()[0]
+        self.hash = args.incremental_hash
+        self.force = args.force
+        self.batch_size = batch_size
+        self.seen = []
+        self.updates = []
+        self.walk_complete = False
+        # commands may be generated in a different thread than they are recorded in (--no-mux)
+        self.lock = threading.Lock()
+
+    def check(self, entry: os.DirEntry) -> typing.Optional[tuple]:
+        """return the state of the file to record once its command succeeds, or None if it is unchanged"""
+        stat = entry.stat()
+        file_state = (entry.path, stat.st_mtime_ns, stat.st_size, stat.st_ino, None)
+        with self.lock:
+            row = self.conn.execute("SELECT mtime_ns, size, inode, digest FROM files WHERE template = ? AND path = ?", (self.template, entry.path)).fetchone()
+            self.seen.append((self.run, self.template, entry.path))
+            if len(self.seen) >= self.batch_size:
+                self.flush()
+        if row is not None and row[:3] == file_state[1:4] and not self.force:
+            return None
+        if self.hash:
+            file_state = file_state[:4] + (file_digest(entry.path),)
+            if row is not None and row[3] == file_state[4] and not self.force:
+                # only the metadata changed, such as from touch or a copy
+                self.record(file_state)
+                return None
+        return file_state
+
+    def record(self, file_state: tuple) -> None:
+        with self.lock:
+            self.updates.append((self.template,) + file_state + (self.run,))
+            if len(self.updates) >= self.batch_size:
+                self.flush()
+
+    def flush(self) -> None:
+        with self.conn:
+            self.conn.executemany("UPDATE files SET seen = ? WHERE template = ? AND path = ?", self.seen)
+            self.conn.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)", self.updates)
+        self.seen, self.updates = [], []
+
+    def close(self) -> None:
+        with self.lock:
+            self.flush()
+            if self.walk_complete:
+                with self.conn:
+                    self.conn.execute("DELETE FROM files WHERE template = ? AND seen < ?", (self.template, self.run))
+            self.conn.close()
+
+
+def command_template_hash(args: argparse.Namespace) -> str:
+    """identify the command and options that affect how it is built, so the incremental cache is only reused for the same command"""
+    import hashlib
+    import json
+    options = ["command", "input_mode", "folders", "replace_str", "format_str", "re_split", "re_groups", "resub", "fstring",
+               "subprocess_shell", "pyex", "pyev", "pyprt", "sql", "dataframe", "json", "pre"]
+    template = json.dumps([getattr(args, option) for option in options])
+    return hashlib.sha256(template.encode("utf-8", "surrogateescape")).hexdigest()[:16]
+
+
+def file_digest(path: str) -> typing.Optional[str]:
+    import hashlib
+    try:
+        with open(path, "rb") as fd:
+            digest = hashlib.sha256()
+            for chunk in iter(lambda: fd.read(1024 * 1024), b""):
+                digest.update(chunk)
+            return digest.hexdigest()
+    except OSError:
+        return None
+
+
+def read_joblog(path: str) -> typing.Iterator[typing.Tuple[str, str, float]]:
+    """yield the input, exit status, and duration of each line of a job log"""
+    import json
+    if not os.path.exists(path):
+        return
+    with open(path, "r") as fd:
+        for line in fd:
+            fields = line.rstrip("\n").split("\t", 3)
+            if len(fields) != 4 or fields[0] == "Starttime":
+                continue
+            try:
+                yield json.loads(fields[3]), fields[2], float(fields[1])
+            except ValueError:
+                # partially written line from an interrupted run
+                continue
+
+
+def load_joblog(path: str, failed: bool) -> set:
+    """load the inputs recorded in a job log, or only those that succeeded if failed inputs are to be retried"""
+    return {key for key, returncode, _ in read_joblog(path) if not failed or returncode == "0"}
+
+
+def load_durations(path: str) -> dict:
+    """load the most recent duration of each input recorded in a job log for --order history"""
+    return {key: duration for key, _, duration in read_joblog(path)}
+
+
+def timed_phase(name: str) -> typing.ContextManager:
+    """time a phase of the run if statistics are being collected"""
+    return stats.phase(name) if stats is not None else contextlib.nullcontext()
+
+
+def timed_items(name: str, items: typing.Iterable[str]) -> typing.Iterable[str]:
+    """time a phase spent producing items from a lazy iterable if statistics are being collected"""
+    return stats.phase_items(name, items) if stats is not None else items
+
+
+class Stats:
+    """statistics for the run: time spent in each phase, counts of exit status, and a histogram of command durations
+
+    durations are counted in buckets of powers of two microseconds so recording a command is constant time and memory,
+    except with --order, where the duration of each command is kept to estimate the makespan had it run in walk order,
+    functions appended to hooks (such as from --pre) are called with the input, exit status, start time, and duration
+    of each completed command, and the progress line is written from a separate thread at a fixed interval
+    """
+
+    def __init__(self) -> None:
+        import threading
+        self.start = time.perf_counter()
+        self.phases = {}
+        self.exit_status = collections.Counter()
+        self.histogram = collections.Counter()
+        self.commands = 0
+        self.inputs = 0
+        self.filtered = None
+        self.duration_total = 0.0
+        self.duration_min = float("inf")
+        self.duration_max = 0.0
+        self.first_start = float("inf")
+        self.last_end = 0.0
+        self.slots = 1
+        self.positions = None
+        self.scheduled = []
+        self.hooks = []
+        self.total = None
+        self.progress_start = None
+        self.progress_thread = None
+        self.progress_stop = threading.Event()
+        self.reported = False
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> typing.Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def phase_items(self, name: str, items: typing.Iterable[str]) -> typing.Iterator[str]:
+        iterator = iter(items)
+        while True:
+            with self.phase(name):
+                item = next(iterator, None)
+            if item is None:
+                return
+            yield item
+
+    def record(self, command: Command, returncode: typing.Optional[int], start: float, duration: float) -> None:
+        self.commands += 1
+        self.inputs += len(command.batch) if command.batch is not None else 1
+        self.exit_status[returncode] += 1
+        # bucket e counts durations less than 2**e microseconds
+        self.histogram[max(0, math.frexp(duration * 1000000)[1])] += 1
+        self.duration_total += duration
+        self.duration_min = min(self.duration_min, duration)
+        self.duration_max = max(self.duration_max, duration)
+        self.first_start = min(self.first_start, start)
+        self.last_end = max(self.last_end, start + duration)
+        if self.positions is not None and (command.dir, command.input) in self.positions:
+            self.scheduled.append((*self.positions[command.dir, command.input], duration))
+        for hook in self.hooks:
+            hook(command.input, returncode, start, duration)
+
+    def percentile(self, fraction: float) -> float:
+        """estimate the duration of the given fraction of commands from the histogram, interpolated within its bucket"""
+        rank = fraction * self.commands
+        count = 0
+        for bucket in sorted(self.histogram):
+            if count + self.histogram[bucket] >= rank:
+                lower = 2 ** (bucket - 1) if bucket > 0 else 0
+                estimate = (lower + (2 ** bucket - lower) * (rank - count) / self.histogram[bucket]) / 1000000
+                return min(max(estimate, self.duration_min), self.duration_max)
+            count += self.histogram[bucket]
+        return self.duration_max
+
+    def schedule(self) -> dict:
+        """makespan from the first command starting to the last finishing, how busy the slots were, and its lower bound for any order"""
+        import heapq
+        makespan = self.last_end - self.first_start if self.commands else 0.0
+        schedule = {
+            "slots": self.slots,
+            "makespan": makespan,
+            "utilisation": self.duration_total / (makespan * self.slots) if makespan > 0 else None,
+            "lower_bound": max(self.duration_total / self.slots, self.duration_max),
+        }
+        if self.scheduled:
+            # simulate starting each command on the first free slot, in walk order and in the order they ran
+            for name, position in [("estimated_walk_order", 0), ("estimated_order", 1)]:
+                slots = [0.0] * self.slots
+                for item in sorted(self.scheduled, key=lambda item: item[position]):
+                    heapq.heapreplace(slots, slots[0] + item[2])
+                schedule[name] = max(slots)
+        return schedule
+
+    def summary(self) -> dict:
+        elapsed = time.perf_counter() - self.start
+        executing = self.phases.get("execute", elapsed)
+        return {
+            "elapsed": elapsed,
+            "phases": dict(self.phases),
+            "commands": self.commands,
+            "inputs": self.inputs,
+            "filtered": self.filtered,
+            "throughput": self.commands / executing if executing > 0 else None,
+            "exit_status": {str(returncode): count for returncode, count in sorted(self.exit_status.items(), key=lambda item: (item[0] is None, item[0] or 0))},
+            "duration": {
+                "total": self.duration_total,
+                "min": self.duration_min if self.commands else None,
+                "mean": self.duration_total / self.commands if self.commands else None,
+                "max": self.duration_max,
+                "p50": self.percentile(0.5),
+                "p90": self.percentile(0.9),
+                "p99": self.percentile(0.99),
+            },
+            "histogram": {f"<{2 ** bucket}us": self.histogram[bucket] for bucket in sorted(self.histogram)},
+            "schedule": self.schedule(),
+        }
+
+    def report(self, args: argparse.Namespace) -> None:
+        """print the summary to stderr, or write it as json to the --stats file (one per chunk with --procs)"""
+        import json
+        if self.reported or args.stats is None:
+            return
+        self.reported = True
+        summary = self.summary()
+        if args.stats != "-":
+            summary["argv"] = sys.argv[1:]
+            summary["chunk"] = args.chunk
+            path = args.stats if args.chunk is None else f"{args.stats}.{args.chunk}"
+            with open(path, "w") as fd:
+                json.dump(summary, fd, indent=2)
+            return
+        duration = summary["duration"]
+        lines = [
+            f"commands: {self.commands}, inputs: {self.inputs}" + (f", filtered: {self.filtered}" if self.filtered is not None else ""),
+            "phases: " + ", ".join(f"{name} {seconds:.3f}s" for name, seconds in summary["phases"].items()) + f", total {summary['elapsed']:.3f}s",
+            f"throughput: {summary['throughput'] or 0:.1f} commands/s",
+            "exit status: " + ", ".join(f"{returncode}: {count}" for returncode, count in summary["exit_status"].items()),
+        ]
+        if self.commands:
+            lines.append(f"duration: min {duration['min'] * 1000:.2f}ms, mean {duration['mean'] * 1000:.2f}ms, max {duration['max'] * 1000:.2f}ms, "
+                         f"p50 {duration['p50'] * 1000:.2f}ms, p90 {duration['p90'] * 1000:.2f}ms, p99 {duration['p99'] * 1000:.2f}ms")
+            lines.append("histogram: " + ", ".join(f"{bucket} {count}" for bucket, count in summary["histogram"].items()))
+            schedule = summary["schedule"]
+            lines.append(f"schedule: makespan {schedule['makespan']:.3f}s on {schedule['slots']} slots, utilisation {100 * (schedule['utilisation'] or 0):.1f}%, lower bound {schedule['lower_bound']:.3f}s"
+                         + (f", estimated {schedule['estimated_walk_order']:.3f}s in walk order vs {schedule['estimated_order']:.3f}s with --order" if "estimated_order" in schedule else ""))
+        print("\n".join(lines), file=sys.stderr)
+
+    def start_progress(self, total: typing.Optional[int]) -> None:
+        import threading
+        self.total = total
+        self.progress_start = time.perf_counter()
+        self.progress_thread = threading.Thread(target=self.show_progress, daemon=True)
+        self.progress_thread.start()
+
+    def stop_progress(self) -> None:
+        self.progress_stop.set()
+        self.progress_thread.join()
+        self.write_progress(final=True)
+
+    def show_progress(self) -> None:
+        while not self.progress_stop.wait(PROGRESS_INTERVAL):
+            self.write_progress()
+
+    def write_progress(self, final: bool = False) -> None:
+        elapsed = time.perf_counter() - self.progress_start
+        done = self.commands
+        rate = done / elapsed if elapsed > 0 else 0.0
+        if self.total:
+            remaining = (self.total - done) / rate if rate > 0 else float("inf")
+            eta = time.strftime("%H:%M:%S", time.gmtime(remaining)) if remaining != float("inf") else "--:--:--"
+            line = f"{done}/{self.total} ({100 * done / self.total:.1f}%) {rate:.1f}/s ETA {eta}"
+        else:
+            line = f"{done} {rate:.1f}/s elapsed {time.strftime('%H:%M:%S', time.gmtime(elapsed))}"
+        # rewrite the same line on a terminal, otherwise append lines
+        if sys.stderr.isatty():
+            sys.stderr.write(f"\r{line}\033[K" + ("\n" if final else ""))
+        else:
+            sys.stderr.write(line + "\n")
+        sys.stderr.flush()
+
+
+class Throttle:
+    """limit how many commands run at once by the system load, available memory, and pressure stall information (linux), and how often they start
+
+    every interval seconds the limit is lowered by one if any threshold is exceeded, otherwise raised by one, between 1 and maximum,
+    each change is printed with --verbose so the thresholds can be tuned
+    """
+
+    def __init__(self, args: argparse.Namespace, maximum: int, interval: float = 1.0) -> None:
+        self.args = args
+        self.maximum = maximum
+        self.interval = interval
+        self.next_update = time.monotonic() + interval
+        self.last_start = 0.0
+        # start with a single command if the system is already busy
+        self.limit = maximum if self.exceeded() is None else 1
+
+    def exceeded(self) -> typing.Optional[str]:
+        """return the first threshold that is exceeded, if any"""
+        if self.args.load_max is not None:
+            load = os.getloadavg()[0]
+            if load > self.args.load_max:
+                return f"load {load:.2f} > {self.args.load_max}"
+        if self.args.mem_free is not None:
+            try:
+                with open("/proc/meminfo", "rb") as fd:
+                    available = next(int(line.split()[1]) * 1024 for line in fd if line.startswith(b"MemAvailable:"))
+                if available < self.args.mem_free:
+                    return f"available memory {available // 2**20} MiB < {self.args.mem_free // 2**20} MiB"
+            except (OSError, StopIteration):
+                pass
+        if self.args.psi_max is not None:
+            for resource in ["cpu", "memory", "io"]:
+                try:
+                    with open(f"/proc/pressure/{resource}", "rb") as fd:
+                        # some avg10=0.00 avg60=0.00 avg300=0.00 total=0
+                        pressure = float(fd.readline().split()[1].split(b"=")[1])
+                except (OSError, IndexError, ValueError):
+                    continue
+                if pressure > self.args.psi_max:
+                    return f"{resource} pressure {pressure:.2f}% > {self.args.psi_max}%"
+        return None
+
+    def update(self) -> int:
+        """adjust the limit at most once per interval and return it"""
+        now = time.monotonic()
+        if now >= self.next_update:
+            self.next_update = now + self.interval
+            reason = self.exceeded()
+            if reason is not None and self.limit > 1:
+                self.limit -= 1
+                if self.args.verbose:
+                    colour_print([f"Throttle: {reason}, running up to {self.limit} at once"], "Y")
+            elif reason is None and self.limit < self.maximum:
+                self.limit += 1
+                if self.args.verbose:
+                    colour_print([f"Throttle: below thresholds, running up to {self.limit} at once"], "Y")
+        return self.limit
+
+    def pace(self) -> None:
+        """wait until --delay seconds have passed since the last command was started"""
+        if self.args.delay:
+            pause = self.last_start + self.args.delay - time.monotonic()
+            if pause > 0:
+                time.sleep(pause)
+            self.last_start = time.monotonic()
+
+    def wait(self, running: typing.Callable[[], int]) -> None:
+        """wait until fewer commands than the limit are running, then pace them"""
+        while running() >= self.update():
+            time.sleep(0.05)
+        self.pace()
+
+
+def parse_size(size: str) -> int:
+    """parse a number of bytes with an optional K, M, G, or T suffix (powers of 1024)"""
+    units = {"K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40}
+    if size[-1:].upper() in units:
+        return int(float(size[:-1]) * units[size[-1].upper()])
+    return int(size)
+
+
+def combine_status(status: int, returncode: typing.Optional[int]) -> int:
+    """combine exit statuses like xargs: 123 if any command failed, 124 if one exited with 255, 125 if one was killed by a signal, 126 if one could not run, 127 if one was not found"""
+    if not returncode:
+        return status
+    if returncode < 0:
+        returncode = 125
+    elif returncode == 255:
+        returncode = 124
+    elif returncode not in (126, 127):
+        returncode = 123
+    return max(status, returncode)
+
+
+def execute_command(args: argparse.Namespace, command: Command, user_namespace: dict, output: typing.Optional[tuple] = None) -> typing.Optional[int]:
+    """prepare and execute a single command and return its exit status, or None if it was not run"""
+    cmd = prepare_command(args, command, user_namespace)
+    if cmd is None:
+        return None
+    returncode = run_command(args, cmd, command, user_namespace, output)
+    if args.results is not None and (args.pyex or args.pyev or args.pyprt or args.sql) and not sys.platform.startswith("win32"):
+        # python code and sql run in this process
+        import resource
+        command.rss = peak_rss(resource.getrusage(resource.RUSAGE_SELF))
+    return returncode
+
+
+def execute_vector(args: argparse.Namespace, commands: typing.Iterable[Command], user_namespace: dict) -> int:
+    """evaluate or execute the code once for each chunk of up to --vector-size inputs, with the variables X (and S with --split or --groups) bound to the whole chunk
+
+    X is a numpy array of strings and S a numpy array of their splits if numpy is installed (an array of lists if they have different lengths), otherwise they are lists,
+    the result of -e is written with a single write, one item per line if it is a sequence
+    """
+    global i, j, d, X, S, np
+    try:
+        import numpy as np
+    except ImportError:
+        np = None
+    code = compile_cached(args.command[0] if len(args.command) == 1 else " ".join(args.command), "eval" if args.pyev else "exec")
+    status = 0
+    d = args.base_dir
+    commands = iter(commands)
+    while True:
+        chunk = list(itertools.islice(commands, args.vector_size))
+        if not chunk:
+            break
+        inputs = [command.input for command in chunk]
+        X = inputs if np is None else np.array(inputs)
+        if args.re_split or args.re_groups:
+            S = [split_input(args, arg_input) for arg_input in inputs]
+            if np is not None and len(set(map(len, S))) <= 1:
+                S = np.array(S)
+            elif np is not None:
+                # ragged splits are kept as a one dimensional array of lists
+                rows = S
+                S = np.empty(len(rows), object)
+                S[:] = rows
+        i += 1
+        if not args.stream:
+            j -= len(chunk)
+        if args.dry_run:
+            colour_print([f"{replace_surrogates(args.command[0])} # {len(chunk)} inputs"], "0")
+            returncode, start, duration = None, time.time(), 0.0
+        else:
+            returncode, start, duration = run_timed(run_vector, args, code, user_namespace)
+        if stats is not None or joblog is not None or result_sink is not None or incremental_cache is not None:
+            for command in chunk:
+                record_job(args, command, returncode, start, duration / len(chunk))
+        i += len(chunk) - 1
+        status = combine_status(status, returncode)
+    return status
+
+
+def run_vector(args: argparse.Namespace, code: types.CodeType, user_namespace: dict) -> int:
+    """run the code for a chunk of inputs and write the result of -e"""
+    try:
+        if args.pyex:
+            exec(code, globals(), user_namespace)
+            return 0
+        result = eval(code, globals(), user_namespace)
+    except Exception as err:
+        print(str(err), file=sys.stderr)
+        return 1
+    out.append(result)
+    if isinstance(result, (str, bytes)) or not isinstance(result, collections.abc.Iterable):
+        print(result)
+    else:
+        # converting a numpy array or pandas series to a list first is faster than iterating over it
+        if hasattr(result, "tolist"):
+            result = result.tolist()
+        sys.stdout.write("\n".join(map(str, result)) + "\n")
+    sys.stdout.flush()
     return 0
 
 
-def execute_command(args: argparse.Namespace, command_dict: dict, user_namespace: dict) -> None:
-    # prepare to execute command, change directory if required
-    dir_path = command_dict["dir"]
-    cmd = command_dict["cmd"]
-    if args.input_mode == "file":
+def execute_jsonl(args: argparse.Namespace, command: Command, user_namespace: dict) -> typing.Optional[int]:
+    """stream json records, one per line, from stdin (-) or a file in batches and run the command for each with js set to the record and x to its line, returns the combined exit status"""
+    import json
+    global i, d, x, s, js
+    loads = json_loader()
+    d = command.dir
+    cmd = command_line(args, command)
+    if args.dry_run:
+        colour_print(cmd, "0")
+        return None
+    status = 0
+    if command.input == "-" and args.input_mode == "stdin":
+        fd = sys.stdin.buffer
+    else:
+        path = os.path.join(command.dir, command.input) if args.input_mode == "file" else command.input
+        fd = open(path, "rb")
+    try:
+        held = []
+        while True:
+            # read1 returns whatever is available instead of waiting for a full batch, so records from a live producer (such as tail -f) run as they arrive
+            chunk = fd.read1(JSONL_BATCH_SIZE)
+            if chunk and b"\n" not in chunk:
+                # a long record continues in the next chunk
+                held.append(chunk)
+                continue
+            lines = b"".join(held + [chunk]).split(b"\n")
+            # the last line may be incomplete until the input ends
+            held = [lines.pop()] if chunk else []
+            # parse the batch first, then run the command for each record
+            records = []
+            for line in lines:
+                if not line or line.isspace():
+                    continue
+                try:
+                    records.append((line, loads(line)))
+                except ValueError:
+                    try:
+                        # orjson is stricter, such as for NaN and Infinity
+                        records.append((line, json.loads(line)))
+                    except ValueError as err:
+                        print(f"Invalid JSON record: {err}", file=sys.stderr)
+                        status = combine_status(status, 1)
+            for line, record in records:
+                i += 1
+                x = line.rstrip(b"\r\n").decode("utf-8", "surrogateescape")
+                s = x.split()
+                js = project_keys(record, args.js_keys) if args.js_keys is not None else record
+                if args.fstring:
+                    try:
+                        record_cmd = [eval(compile_command(args, f"f\"{part}\"", "eval"), globals(), user_namespace) for part in cmd]
+                    except Exception as err:
+                        print(str(err), file=sys.stderr)
+                        status = combine_status(status, 1)
+                        continue
+                else:
+                    record_cmd = cmd
+                status = combine_status(status, run_command(args, record_cmd, command, user_namespace))
+            if not chunk:
+                break
+    finally:
+        if fd is not sys.stdin.buffer:
+            fd.close()
+    return status
+
+
+def json_loader() -> typing.Callable:
+    """return orjson.loads if installed since it is much faster, otherwise json.loads
+
+    orjson quietly parses integers wider than 64 bits as floats, so lines with a run of 20 or more digits are parsed with json instead
+    """
+    import json
+    try:
+        import orjson
+    except ImportError:
+        return json.loads
+    wide_integer = re.compile(rb"\d{20}").search
+
+    def loads(line: bytes) -> typing.Any:
+        return json.loads(line) if wide_integer(line) else orjson.loads(line)
+
+    return loads
+
+
+def project_keys(record: typing.Any, keys: list) -> typing.Any:
+    """keep only the given keys of a json object"""
+    if isinstance(record, dict):
+        return {key: record[key] for key in keys if key in record}
+    return record
+
+
+def prepare_command(args: argparse.Namespace, command: Command, user_namespace: dict) -> typing.Optional[list]:
+    """update the variables available to the user and return the final command, or None if it should not be run"""
+    # change directory if required for python code, subprocesses are started with cwd instead
+    dir_path = command.dir
+    if args.input_mode == "file" and (args.fstring or args.pyex or args.pyev or args.sql or args.dataframe or args.json):
         os.chdir(dir_path)
     # update variables always available to the user
-    global i, j, n, a, out, d, x, s
-    i, j = i + 1, j - 1
-    d = command_dict["dir"]
-    x = command_dict["input"]
+    global i, j, d, x, s
+    i += 1
+    if not args.stream:
+        j -= 1
+    d = command.dir
+    x = command.input
     if args.re_split or args.re_groups:
-        s = command_dict["input_split"]
+        s = split_input(args, x)
     elif args.input_mode in ["path", "abspath"]:
         s = x.split(os.path.sep)
     elif args.input_mode == "file":
         s = os.path.splitext(x)
     else:
         s = x.split()
+    cmd = command_line(args, command, s if args.re_split or args.re_groups else None)
     # update variables only available when flag specified
     if args.dataframe:
         global df
-        if args.input_mode == "stdin":
-            df = pd.read_table(io.StringIO(x), sep=None, engine="python")
-        else:
-            df = pd.read_table(x, sep=None, engine="python")
+        df = read_dataframes(args, command.batch) if args.df_concat else read_dataframe(args, x)
     elif args.json:
         global js
+        import json
         if args.input_mode == "stdin":
             js = json.loads(x)
         else:
             with open(x, "r") as fd:
                 js = json.load(fd)
+        if args.js_keys is not None:
+            js = project_keys(js, args.js_keys)
     if args.sql:
-        global db, conn
+        global db
         if args.dataframe:
-            db = duckdb.from_df(df)
-        elif args.input_mode == "stdin":
-            try:
-                tf = tempfile.NamedTemporaryFile(mode="w+")
-                tf.write(x)
-                tf.file.flush()
-                db = duckdb.read_json(tf.name)
-            except Exception:
-                db = duckdb.read_csv(io.StringIO(x))
+            db = conn.from_df(df)
+        elif command.batch is not None:
+            db = read_sql_union(args, command.batch)
         else:
-            try:
-                conn = duckdb.connect(x, read_only=True)
-                db = [row[0] for row in conn.sql("SHOW TABLES;").fetchall()]
-            except Exception:
-                conn = duckdb.connect(":default:")
-                try:
-                    db = duckdb.read_json(x)
-                except Exception:
-                    try:
-                        db = duckdb.read_parquet(x)
-                    except Exception:
-                        try:
-                            db = duckdb.read_csv(x)
-                        except Exception:
-                            db = Exception(r"Could not read file, try replace-str '{}' or f-string '{x}' to pass the file path, or check duckdb extensions")
+            db = read_sql_input(args, x)
     # return early if dry run (still safe to do after setting variables, and tests if any fail, but probably still want to do this before evaluating f-strings)
     if args.dry_run:
         colour_print(cmd, "0")
-        return
+        return None
     # optionally print, then execute command
     if args.verbose:
         old_cmd = cmd.copy()
@@ -287,26 +1988,229 @@ def execute_command(args: argparse.Namespace, command_dict: dict, user_namespace
     if args.fstring:
         # evaluate f-strings
         try:
-            cmd = [eval(f"f\"{part}\"", globals(), user_namespace) for part in cmd]
+            cmd = [eval(compile_command(args, f"f\"{part}\"", "eval"), globals(), user_namespace) for part in cmd]
         except Exception as err:
             print(str(err), file=sys.stderr)
-            return
+            return None
         # print verbose again after evaluation, pyprt already prints at this stage
         if args.verbose and not args.pyprt:
             if cmd != old_cmd:
                 colour_print(cmd, "Y")
+    return cmd
+
+
+def read_sql_input(args: argparse.Namespace, arg_input: str) -> typing.Any:
+    """read an input into a duckdb relation with the reader for its format, or attach it and return its tables if it is a database"""
+    detach_database()
+    try:
+        if args.input_mode == "stdin":
+            return read_sql_stdin([arg_input])
+        file_format = detect_format(arg_input)
+        if file_format in ("duckdb", "sqlite"):
+            return attach_database(arg_input, file_format)
+        return scan_files(file_format, [arg_input])
+    except Exception:
+        return Exception(r"Could not read file, try replace-str '{}' or f-string '{x}' to pass the file path, or check duckdb extensions")
+
+
+def read_sql_union(args: argparse.Namespace, arg_inputs: list) -> typing.Any:
+    """read all inputs into a single relation for --sql-union, files of the same format are scanned together by duckdb in parallel"""
+    detach_database()
+    if args.input_mode == "stdin":
+        try:
+            return read_sql_stdin(arg_inputs)
+        except Exception as err:
+            return err
+    file_formats = {detect_format(path) for path in arg_inputs}
+    if len(file_formats) != 1 or not file_formats <= set(SQL_SCANS):
+        return Exception(f"Could not read files as a single relation, --sql-union requires files of the same format (csv, json, or parquet), found: {', '.join(sorted(file_formats))}")
+    try:
+        return scan_files(file_formats.pop(), arg_inputs)
+    except Exception as err:
+        return err
+
+
+def read_sql_stdin(arg_inputs: list) -> typing.Any:
+    """load inputs from stdin into temporary tables and return them as a single relation, json is only attempted if it looks like json
+
+    duckdb can only read from memory with fsspec installed, so each input is written to the same temporary file and copied into a table
+    """
+    global sql_stdin_file
+    import tempfile
+    if sql_stdin_file is None:
+        sql_stdin_file = tempfile.NamedTemporaryFile("w", encoding="utf-8", errors="surrogateescape", prefix="pyxargs-")
+        atexit.register(sql_stdin_file.close)
+    file_formats = set()
+    for index, arg_input in enumerate(arg_inputs):
+        sql_stdin_file.seek(0)
+        sql_stdin_file.truncate()
+        sql_stdin_file.write(arg_input)
+        sql_stdin_file.flush()
+        for file_format in (["json", "csv"] if arg_input.lstrip()[:1] in ("{", "[") else ["csv"]):
+            try:
+                conn.execute(f"CREATE OR REPLACE TEMP TABLE pyxargs_stdin_{index} AS SELECT * FROM {SQL_SCANS[file_format]}({sql_quote(sql_stdin_file.name)})")
+                break
+            except Exception:
+                if file_format == "csv":
+                    raise
+        file_formats.add(file_format)
+    if len(file_formats) != 1:
+        raise Exception(f"Could not read inputs as a single relation, --sql-union requires inputs of the same format (csv or json), found: {', '.join(sorted(file_formats))}")
+    return conn.sql(" UNION ALL BY NAME ".join(f"SELECT * FROM pyxargs_stdin_{index}" for index in range(len(arg_inputs))))
+
+
+def detect_format(path: str) -> str:
+    """detect the format of a file from its extension, or its first bytes, caching the result for the extension"""
+    root, extension = os.path.splitext(path.lower())
+    if extension in (".gz", ".zst"):
+        # compressed csv and json files are decompressed by duckdb
+        extension = os.path.splitext(root)[1]
+    if extension in SQL_FORMATS:
+        return SQL_FORMATS[extension]
+    if extension and extension in sql_format_cache:
+        return sql_format_cache[extension]
+    try:
+        with open(path, "rb") as fd:
+            header = fd.read(64)
+    except OSError:
+        return "csv"
+    if header.startswith(b"SQLite format 3\0"):
+        file_format = "sqlite"
+    elif header[8:12] == b"DUCK":
+        file_format = "duckdb"
+    elif header.startswith(b"PAR1"):
+        file_format = "parquet"
+    elif header.lstrip()[:1] in (b"{", b"["):
+        file_format = "json"
+    else:
+        file_format = "csv"
+    if extension:
+        sql_format_cache[extension] = file_format
+    return file_format
+
+
+def sql_quote(string: str) -> str:
+    return "'" + string.replace("'", "''") + "'"
+
+
+def scan_files(file_format: str, paths: list) -> typing.Any:
+    """return a relation scanning one or more files of the same format, multiple files are unioned by column name"""
+    files = ", ".join(sql_quote(path) for path in paths)
+    options = ", union_by_name = true" if len(paths) > 1 else ""
+    return conn.sql(f"SELECT * FROM {SQL_SCANS[file_format]}([{files}]{options})")
+
+
+def attach_database(path: str, file_format: str) -> list:
+    """attach a database read only to the connection, use it for queries, and return its tables"""
+    global sql_attached
+    conn.execute(f"ATTACH {sql_quote(path)} AS pyxargs_input (READ_ONLY{', TYPE SQLITE' if file_format == 'sqlite' else ''})")
+    conn.execute("USE pyxargs_input")
+    sql_attached = True
+    return [row[0] for row in conn.sql("SHOW TABLES").fetchall()]
+
+
+def detach_database() -> None:
+    """detach the database attached for the previous input, if any"""
+    global sql_attached
+    if sql_attached:
+        conn.execute(f"USE {sql_database}")
+        conn.execute("DETACH pyxargs_input")
+        sql_attached = False
+
+
+def read_dataframe(args: argparse.Namespace, arg_input: str) -> typing.Any:
+    """read an input into a dataframe with the c (or pyarrow) parser, the separator is sniffed from a sample of each input if not given"""
+    # inputs may have different separators (such as csv and tsv files), which the c parser would quietly read as a single column
+    sep = args.df_sep if args.df_sep is not None else sniff_separator(args, arg_input)
+    # the columns and their types are the same whichever parser reads the input
+    columns = {}
+    if args.df_columns is not None:
+        columns["usecols"] = args.df_columns
+    if args.df_arrow:
+        columns["dtype_backend"] = "pyarrow"
+    options = dict(columns, sep=sep, engine=args.df_engine)
+    if args.input_mode == "stdin":
+        source = io.StringIO(arg_input)
+    else:
+        source = arg_input
+        # files are read through a memory map instead of being copied (only supported by the c parser)
+        if args.df_engine == "c":
+            options["memory_map"] = True
+    try:
+        return pd.read_csv(source, **options)
+    except Exception:
+        if args.df_sep is not None:
+            raise
+        # fall back to sniffing all of this input with the python parser, such as when the sample was not enough
+        if args.input_mode == "stdin":
+            source = io.StringIO(arg_input)
+        return pd.read_table(source, sep=None, engine="python", **columns)
+
+
+def read_dataframes(args: argparse.Namespace, arg_inputs: list) -> typing.Any:
+    """read all inputs with a pool of threads (the parsers release the gil) and concatenate them into one dataframe for --df-concat"""
+    import concurrent.futures
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        frames = list(executor.map(functools.partial(read_dataframe, args), arg_inputs))
+    return pd.concat(frames, ignore_index=True)
+
+
+def sniff_separator(args: argparse.Namespace, arg_input: str) -> str:
+    """sniff the separator from a sample of an input like the python parser does, defaults to a comma"""
+    import csv
+    if args.input_mode == "stdin":
+        sample = arg_input[:65536]
+    else:
+        with open(arg_input, "r", errors="replace") as fd:
+            sample = fd.read(65536)
+    # only sniff complete lines
+    if "\n" in sample[:-1]:
+        sample = sample[:sample.rindex("\n", 0, len(sample) - 1) + 1]
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=",\t;| ").delimiter
+    except csv.Error:
+        return ","
+
+
+def union_commands(args: argparse.Namespace, commands: typing.Iterable[Command]) -> typing.Iterator[Command]:
+    """combine all commands into one for --sql-union or --df-concat, with the inputs as file paths relative to the current directory (for input modes: file, path, abspath)"""
+    batch, states = [], []
+    for command in commands:
+        batch.append(os.path.join(command.dir, command.input) if args.input_mode == "file" else command.input)
+        states.append(command.state)
+    if batch:
+        yield Command(args.base_dir, " ".join(batch), batch, states)
+
+
+@functools.lru_cache(maxsize=256)
+def compile_cached(source: str, mode: str) -> types.CodeType:
+    return compile(source, "<string>", mode)
+
+
+def compile_command(args: argparse.Namespace, source: str, mode: str) -> types.CodeType:
+    """compile python code for exec or eval, only once if the command does not change with each input (the input is read from variables instead)"""
+    if args.static_command:
+        return compile_cached(source, mode)
+    # the input was substituted into the source code, so caching would only fill up with unique entries
+    return compile(source, "<string>", mode)
+
+
+def run_command(args: argparse.Namespace, cmd: list, command: Command, user_namespace: dict, output: typing.Optional[tuple] = None) -> int:
+    """run a prepared command as python code, sql, or a subprocess and return its exit status"""
     if args.pyex:
         try:
-            exec(cmd[0], globals(), user_namespace)
+            exec(compile_command(args, cmd[0], "exec"), globals(), user_namespace)
         except Exception as err:
             print(str(err), file=sys.stderr)
+            return 1
     elif args.pyev:
         try:
-            result = eval(cmd[0], globals(), user_namespace)
+            result = eval(compile_command(args, cmd[0], "eval"), globals(), user_namespace)
             out.append(result)
             print(result)
         except Exception as err:
             print(str(err), file=sys.stderr)
+            return 1
     elif args.pyprt:
         out.append(cmd[0])
         print(cmd[0])
@@ -316,27 +2220,98 @@ def execute_command(args: argparse.Namespace, command_dict: dict, user_namespace
             out.append(result)
             print(result)
         except Exception as err:
-            print(str(err), file=sys.stderr)
-    elif args.subprocess_shell:
-        subprocess.run(cmd[0], shell=True)
+            # querying an input that could not be read fails with an error about the type of db, show why it could not be read instead
+            print(str(db if isinstance(db, Exception) else err), file=sys.stderr)
+            return 1
     else:
-        subprocess.run(cmd, shell=False)
+        return run_subprocess(args, cmd, command, output)
+    return 0
 
 
-def main() -> int:
-    signal.signal(signal.SIGINT, lambda *args: sys.exit(128 + signal.SIGINT))
-    signal.signal(signal.SIGTERM, lambda *args: sys.exit(128 + signal.SIGTERM))
+def run_subprocess(args: argparse.Namespace, cmd: list, command: Command, output: typing.Optional[tuple] = None) -> int:
+    """run a command as a subprocess (safe to call from multiple threads) and return its exit status, optionally capturing its stdout and stderr to a pair of binary files"""
+    import subprocess
+    # only file mode executes commands in their respective directories
+    cwd = command.dir if args.input_mode == "file" else None
+    stderr = sys.stderr if output is None else io.TextIOWrapper(output[1], write_through=True)
+    # wait for the process with wait4 to get its peak memory for --results
+    usage = args.results is not None and hasattr(os, "wait4")
+    try:
+        if output is None and not usage:
+            if args.subprocess_shell:
+                return subprocess.run(cmd[0], shell=True, cwd=cwd).returncode
+            else:
+                return subprocess.run(cmd, shell=False, cwd=cwd).returncode
+        pipe = None if output is None else subprocess.PIPE
+        with subprocess.Popen(cmd[0] if args.subprocess_shell else cmd, shell=args.subprocess_shell, cwd=cwd, stdout=pipe, stderr=pipe) as proc:
+            if output is not None:
+                copy_pipes(proc, *output)
+            if usage:
+                proc.returncode, command.rss = wait_usage(proc.pid)
+            return proc.wait()
+    except FileNotFoundError as err:
+        print(str(err), file=stderr)
+        return 127
+    except PermissionError as err:
+        print(str(err), file=stderr)
+        return 126
+    except OSError as err:
+        import errno
+        # the command line is longer than the system allows
+        if err.errno != errno.E2BIG:
+            raise
+        print(str(err), file=stderr)
+        return 126
+    finally:
+        if output is not None:
+            stderr.detach()
+
+
+def copy_pipes(proc: "subprocess.Popen", stdout: typing.BinaryIO, stderr: typing.BinaryIO) -> None:
+    """copy the stdout and stderr pipes of a process to files as data arrives, without holding it all in memory"""
+    import selectors
+    if sys.platform.startswith("win32"):
+        # selectors do not support pipes on windows
+        out_data, err_data = proc.communicate()
+        stdout.write(out_data)
+        stderr.write(err_data)
+        return
+    destinations = {proc.stdout: stdout, proc.stderr: stderr}
+    with selectors.DefaultSelector() as selector:
+        for pipe in destinations:
+            selector.register(pipe, selectors.EVENT_READ)
+        while selector.get_map():
+            for key, _ in selector.select():
+                data = os.read(key.fd, 65536)
+                if data:
+                    destinations[key.fileobj].write(data)
+                else:
+                    selector.unregister(key.fileobj)
+
+
+def build_parser() -> argparse.ArgumentParser:
     class ArgparseCustomFormatter(argparse.HelpFormatter):
         def _split_lines(self, text, width):
             if text[:2] == 'F!':
                 return text.splitlines()[1:]
             return argparse.HelpFormatter._split_lines(self, text, width)
+
+    def terminal_columns() -> int:
+        # same as shutil.get_terminal_size, which argparse would otherwise import to format the help
+        try:
+            return int(os.environ["COLUMNS"])
+        except (KeyError, ValueError):
+            pass
+        try:
+            return os.get_terminal_size(sys.__stdout__.fileno()).columns
+        except (AttributeError, ValueError, OSError):
+            return 80
     readme = ("Build and execute command lines, python code, or mix from standard input or file paths. "
               "The file input mode (default if stdin is not connected) builds commands using filenames only and executes them in their respective directories, "
               "this is useful when dealing with file paths containing multiple character encodings. "
               "When executing python code, the following variables are provided: i=index, j=remaining, n=total, x=input, s=split, d=dir, a=all_inputs, out=previous_results, df=dataframe, js=json, db=duckdb")
     parser = argparse.ArgumentParser(description=readme, epilog="Source: https://github.com/elesiuta/pyxargs",
-                                     formatter_class=lambda prog: ArgparseCustomFormatter(prog, max_help_position=24),
+                                     formatter_class=lambda prog: ArgparseCustomFormatter(prog, max_help_position=24, width=terminal_columns() - 2),
                                      usage="%(prog)s [options] command [initial-arguments ...]\n"
                                            "       %(prog)s -h | --help | --version")
     group0 = parser.add_mutually_exclusive_group()  # delimiter options
@@ -364,10 +2339,34 @@ def main() -> int:
                         help="use folders instead files (for input modes: file, path, abspath)")
     parser.add_argument("-t", "--top", action="store_true", dest="top_level",
                         help="do not recurse into subdirectories (for input modes: file, path, abspath)")
+    parser.add_argument("--prune", type=str, default=[], action="append", metavar="glob", dest="prune",
+                        help="do not descend into (or use with --folders) directories whose name or relative path matches glob, such as .git or node_modules, can be repeated (for input modes: file, path, abspath)")
+    parser.add_argument("--max-depth", type=int, default=None, metavar="n", dest="max_depth",
+                        help="only descend n levels of directories, files in the base directory are at depth 1 (for input modes: file, path, abspath)")
+    parser.add_argument("--min-depth", type=int, default=0, metavar="n", dest="min_depth",
+                        help="only use files (or folders) at depth n or deeper (for input modes: file, path, abspath)")
+    parser.add_argument("--include", type=str, default=[], action="append", metavar="glob", dest="include",
+                        help="only use files (or folders) whose name matches any include glob, can be repeated (for input modes: file, path, abspath)")
+    parser.add_argument("--exclude", type=str, default=[], action="append", metavar="glob", dest="exclude",
+                        help="do not use files (or folders) whose name matches any exclude glob, can be repeated (for input modes: file, path, abspath)")
+    parser.add_argument("--type", type=str, default=None, choices=["f", "d", "l"], dest="entry_type",
+                        help="only use regular files, directories (implies --folders), or symlinks (for input modes: file, path, abspath)")
+    parser.add_argument("--size", type=size_bound, default=None, metavar="[+-]size", dest="size",
+                        help="only use files larger (+), smaller (-), or exactly size bytes, with an optional K, M, G, or T suffix, use --size=-size for smaller (for input modes: file, path, abspath)")
+    parser.add_argument("--mtime", type=days_bound, default=None, metavar="[+-]days", dest="mtime",
+                        help="only use files modified more (+) or less (-) than days ago, or that many whole days ago, use --mtime=-days for less (for input modes: file, path, abspath)")
+    parser.add_argument("--newer", type=str, default=None, metavar="file", dest="newer",
+                        help="only use files modified more recently than file (for input modes: file, path, abspath)")
     parser.add_argument("--sym", "--symlinks", action="store_true", dest="symlinks",
                         help="follow symlinks when scanning directories (for input modes: file, path, abspath)")
+    parser.add_argument("--unsorted", action="store_true", dest="unsorted",
+                        help="yield files in the order directories finish being listed instead of sorted (for input modes: file, path, abspath)")
+    parser.add_argument("--walk-threads", type=int, default=None, metavar="n", dest="walk_threads",
+                        help="number of threads for listing directories in parallel, default: min(32, cpu_count + 4) (for input modes: file, path, abspath)")
     parser.add_argument("-a", "--arg-file", type=str, default=None, metavar="file", dest="arg_file",
                         help="read input items from file instead of standard input (for input mode: stdin)")
+    parser.add_argument("--stream", action="store_true", dest="stream",
+                        help="build and execute commands incrementally as input arrives instead of reading all input first, the variables a, n, and j are not available")
     group0.add_argument("-0", "--null", action="store_true", dest="null",
                         help="input items are separated by a null character instead of whitespace (for input mode: stdin)")
     group0.add_argument("-l", "--lines", action="store_true", dest="lines",
@@ -394,10 +2393,30 @@ def main() -> int:
                         help="evaluates commands as python f-strings before execution")
     group2.add_argument("--df", action="store_true", dest="dataframe",
                         help="reads each input into a dataframe and stores it in variable df, requires pandas")
+    parser.add_argument("--df-sep", type=str, default=None, metavar="sep", dest="df_sep",
+                        help="separator of the columns of each input with --df, default: sniffed from the start of each input")
+    parser.add_argument("--df-engine", type=str, default="c", choices=["c", "pyarrow"], dest="df_engine",
+                        help="parser used to read each input with --df, the pyarrow parser is multithreaded and requires pyarrow, default: c")
+    parser.add_argument("--df-arrow", action="store_true", dest="df_arrow",
+                        help="use pyarrow backed data types for the dataframe with --df, requires pyarrow")
+    parser.add_argument("--df-columns", type=str, default=None, metavar="columns", dest="df_columns",
+                        help="only read the given comma separated columns with --df")
+    parser.add_argument("--df-concat", action="store_true", dest="df_concat",
+                        help="reads all inputs in parallel and concatenates them into a single dataframe, then runs the command once, with --df")
     group2.add_argument("--js", action="store_true", dest="json",
                         help="reads each input as a json object and stores it in variable js")
+    group2.add_argument("--jsonl", action="store_true", dest="jsonl",
+                        help="streams json lines from standard input or each file and runs the command once for each record with it stored in variable js and the line in x, uses orjson if installed")
+    parser.add_argument("--vector", action="store_true", dest="vector",
+                        help="with -e or -x, run the code once for each chunk of inputs with X as a numpy array of them (a list if numpy is not installed), and S of their splits with -s or -g, the result of -e is written one item per line")
+    parser.add_argument("--vector-size", type=int, default=1000000, metavar="n", dest="vector_size",
+                        help="number of inputs in each chunk for --vector, default: 1000000")
+    parser.add_argument("--js-keys", type=str, default=None, metavar="keys", dest="js_keys",
+                        help="only keep the given comma separated keys of each json object with --js or --jsonl")
     parser.add_argument("--max-chars", type=int, metavar="n", dest="max_chars",
-                        help="omits any command line exceeding n characters, no limit by default")
+                        help="omits any command line exceeding n characters, no limit by default (with --max-args, limits the length of packed command lines, default: system limit)")
+    parser.add_argument("--max-args", type=int, metavar="n", dest="max_args",
+                        help="pack up to n inputs into each command line (like xargs -n), or as many as fit if n is 0, inputs are appended or replace arguments equal to replace-str (for commands executed as subprocesses)")
     group1.add_argument("--sh", "--shell", action="store_true", dest="subprocess_shell",
                         help="executes commands through the shell (subprocess shell=True) (warning, shlex.quote is not guaranteed to be correct on Windows)")
     group1.add_argument("-x", "--pyex", action="store_true", dest="pyex",
@@ -408,69 +2427,170 @@ def main() -> int:
                         help="evaluates commands as python f-strings then prints them (implies --fstring)")
     group1.add_argument("-q", "--sql", action="store_true", dest="sql",
                         help="reads each input into variable db then runs commands as SQL queries using duckdb.sql(), requires duckdb")
+    parser.add_argument("--sql-union", action="store_true", dest="sql_union",
+                        help="reads all inputs into variable db as a single relation (files of the same format are scanned together) then runs the query once, with --sql")
     parser.add_argument("--import", action="append", type=str, default=[], metavar=("library"), dest="imprt",
                         help="executes 'import <library>' for each library")
     parser.add_argument("--im", "--importstar", action="append", type=str, default=[], metavar=("library"), dest="imprtstar",
                         help="executes 'from <library> import *' for each library")
     parser.add_argument("--pre", type=str, default="", metavar=("\"code\""), dest="pre",
                         help="runs exec(code) before execution")
+    parser.add_argument("--post-worker", type=str, default="", metavar=("\"code\""), dest="post_worker",
+                        help="runs eval(code) in each worker after its last command with --no-mux, the results are available to --post as the list parts")
     parser.add_argument("--post", type=str, default="", metavar=("\"code\""), dest="post",
                         help="runs exec(code) after execution")
+    parser.add_argument("--out-maxlen", type=int, default=None, metavar="n", dest="out_maxlen",
+                        help="only keep the last n results in the variable out (for -e, -p, -q) so memory does not grow with each input, default: keep all")
     parser.add_argument("-P", "--procs", type=int, default=None, metavar="P", dest="procs",
-                        help="split into P chunks and execute each chunk in parallel as a separate process and window with byobu or tmux")
+                        help="execute commands in parallel with P processes, each in a separate window with byobu or tmux, that take the next command as they become free")
     parser.add_argument("-c", "--chunk", type=int, default=None, metavar="c", dest="chunk",
                         help="runs chunk c of P (0 <= c < P) (without multiplexer)")
     parser.add_argument("--_command_pickle", nargs=2, default=None, dest="command_pickle",
                         help=argparse.SUPPRESS)
     parser.add_argument("--no-mux", action="store_true", dest="no_mux",
-                        help="do not use a multiplexer for multiple processes")
+                        help="do not use a multiplexer for multiple processes, instead commands are distributed to a pool of P worker processes as they become free (--import, --im, and --pre run once in each worker instead of the main process)")
+    parser.add_argument("--serve", type=str, default=None, metavar="[host:]port", dest="serve",
+                        help="distribute commands over TCP to workers started with --worker, with -P P also start P local workers, port 0 picks a free port, commands leased to a worker that disconnects or is silent for 30 seconds are handed out again, default host: localhost")
+    parser.add_argument("--worker", type=str, default=None, metavar="host:port", dest="worker",
+                        help="run commands from pyxargs --serve with its options (in the current directory for input mode: stdin), then exit when they are done, the token printed by --serve is read from PYXARGS_TOKEN or stdin")
+    parser.add_argument("--ssh", type=str, default=[], action="append", metavar="host", dest="ssh",
+                        help="start a worker on host with ssh for --serve, can be repeated (pyxargs must be installed on host)")
+    parser.add_argument("--chunksize", type=int, default=None, metavar="n", dest="chunksize",
+                        help="number of commands sent to a worker at a time with --no-mux or --serve, default: based on the number of inputs (1 with --stream)")
+    parser.add_argument("-j", "--jobs", type=int, default=None, metavar="N", dest="jobs",
+                        help="run up to N commands at a time as subprocesses of a single process (like xargs -P), not for python code or sql, exits with 123 if any command failed")
+    parser.add_argument("--group", action="store_true", dest="group",
+                        help="buffer the output of each command and write it all at once when it finishes (for --jobs, --no-mux, or --serve)")
+    parser.add_argument("--order", type=str, default=None, choices=["size-desc", "random", "history"], dest="order",
+                        help="run commands for the largest files first, in random order, or the longest running first by their duration in --joblog from a previous run, so parallel runs do not end waiting on a few large inputs (changes the index i), default: input order")
+    parser.add_argument("-k", "--keep-order", action="store_true", dest="keep_order",
+                        help="write the output of commands in input order (implies --group)")
+    parser.add_argument("--tag", action="store_true", dest="tag",
+                        help="prefix each line of output with the input and a tab (implies --group)")
+    parser.add_argument("--load-max", type=float, default=None, metavar="L", dest="load_max",
+                        help="run fewer commands at once (down to 1) while the 1 minute load average is above L, and more (up to --jobs or --procs) when it is not (for --jobs or --no-mux)")
+    parser.add_argument("--mem-free", type=parse_size, default=None, metavar="size", dest="mem_free",
+                        help="run fewer commands at once while available memory is below size, such as 2G (linux, for --jobs or --no-mux)")
+    parser.add_argument("--psi-max", type=float, default=None, metavar="pct", dest="psi_max",
+                        help="run fewer commands at once while cpu, memory, or io pressure (some avg10) is above pct percent (linux, for --jobs or --no-mux)")
+    parser.add_argument("--delay", type=float, default=0.0, metavar="secs", dest="delay",
+                        help="wait at least secs seconds between starting each command")
+    parser.add_argument("--joblog", type=str, default=None, metavar="file", dest="joblog",
+                        help="append each completed input with its start time, duration, and exit status to file")
+    parser.add_argument("--results", type=str, default=None, metavar="file", dest="results",
+                        help="append the result of each command to file as json lines, or to a sqlite table if file ends in .db, .sqlite, or .sqlite3 (input, command, exit status, start time, duration, and peak memory of the process that ran it)")
+    parser.add_argument("--results-output", action="store_true", dest="results_output",
+                        help="also capture the stdout and stderr of each command in --results (implies --group, for --jobs, --no-mux, or --serve)")
+    parser.add_argument("--resume", action="store_true", dest="resume",
+                        help="skip inputs already recorded in the --joblog file")
+    parser.add_argument("--resume-failed", action="store_true", dest="resume_failed",
+                        help="skip inputs recorded as successful in the --joblog file, retrying those that failed")
+    parser.add_argument("--incremental", type=str, nargs="?", default=None, const=os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "pyxargs", "incremental.sqlite"), metavar="cache", dest="incremental",
+                        help="skip files that are unchanged (mtime, size, inode) since the same command last succeeded for them, as recorded in an sqlite cache, default: ~/.cache/pyxargs/incremental.sqlite (for input modes: file, path, abspath)")
+    parser.add_argument("--incremental-hash", action="store_true", dest="incremental_hash",
+                        help="also compare the sha256 of file contents when their mtime, size, or inode changed with --incremental")
+    parser.add_argument("--force", action="store_true", dest="force",
+                        help="run commands for all files with --incremental, even if unchanged, the cache is still updated")
+    parser.add_argument("--stats", type=str, nargs="?", default=None, const="-", metavar="file", dest="stats",
+                        help="print statistics to stderr when finished (time spent in each phase, throughput, exit status counts, and a histogram of command durations), or write them as json to file, they are also available to --post as the variable stats")
+    parser.add_argument("--progress", action="store_true", dest="progress",
+                        help="show the number of completed commands, throughput, and estimated time remaining on stderr, updated every 0.5 seconds")
+    parser.add_argument("--profile", type=str, default=None, metavar="file", dest="profile",
+                        help="profile the run with cProfile and write the results to file (view with python -m pstats file)")
     parser.add_argument("-i", "--interactive", action="store_true", dest="interactive",
                         help="prompt the user before executing each command, only proceeds if response starts with 'y' or 'Y'")
     parser.add_argument("-n", "--dry-run", action="store_true", dest="dry_run",
                         help="prints commands without executing them")
     parser.add_argument("-v", "--verbose", action="store_true", dest="verbose",
                         help="prints commands before executing them")
-    try:
-        import argcomplete
-        argcomplete.autocomplete(parser)
-    except Exception:
-        pass
+    return parser
+
+
+def prepare_args(args: argparse.Namespace) -> None:
+    """set options implied by other options and defaults that depend on the command"""
+    assert not args.format_str or args.replace_str is None, "invalid option --format-str: cannot specify -I replace-str"
+    # set delimiter
+    if args.null:
+        args.delim = "\0"
+    elif args.lines:
+        args.delim = "\n"
+    # enable format string mode
+    if args.re_split is not None or args.re_groups is not None:
+        args.format_str = True
+    # enable f-string mode
+    if args.pyprt:
+        args.fstring = True
+    # directories are used instead of files
+    if args.entry_type == "d":
+        args.folders = True
+    # enable grouped output
+    if args.keep_order or args.tag or args.results_output:
+        args.group = True
+    # local workers are started by the coordinator instead of a multiplexer
+    if args.serve is not None and args.procs is not None:
+        args.no_mux = True
+    # append input if replace-str is not specified or present in the command, otherwise default to {}, records from --jsonl are only used through variables
+    args.append_input = not (args.pyex or args.pyev or args.pyprt or args.sql or args.resub or args.format_str or args.fstring or args.jsonl) and (args.replace_str is None) and all("{}" not in arg for arg in args.command)
+    args.replace_str = "{}" if args.replace_str is None else args.replace_str
+    # select columns for dataframes and keys for json
+    if isinstance(args.df_columns, str):
+        args.df_columns = args.df_columns.split(",")
+    if isinstance(args.js_keys, str):
+        args.js_keys = args.js_keys.split(",")
+    # commands are only compiled once if the input is not substituted into them
+    args.static_command = not (args.format_str or args.resub) and all(args.replace_str not in arg for arg in args.command)
+
+
+def main() -> int:
+    signal.signal(signal.SIGINT, lambda *args: sys.exit(128 + signal.SIGINT))
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(128 + signal.SIGTERM))
+    parser = build_parser()
+    # only import argcomplete when it is completing the command line
+    if "_ARGCOMPLETE" in os.environ:
+        try:
+            import argcomplete
+            argcomplete.autocomplete(parser)
+        except Exception:
+            pass
     args = parser.parse_args()
-    # determine input mode and read stdin available or required
-    stdin = ""
+    # workers get their options and commands from the coordinator
+    if args.worker is not None:
+        return run_worker(args)
+    # start collecting statistics or profiling before reading input, statistics are reported on exit if interrupted
+    global stats
+    if (args.stats is not None or args.progress) and not (args.procs is not None and args.chunk is None and not args.no_mux and args.serve is None):
+        stats = Stats()
+        atexit.register(stats.report, args)
+    if args.profile is not None:
+        import cProfile
+        profiler = cProfile.Profile()
+        atexit.register(profiler.dump_stats, args.profile)
+        profiler.enable()
+    # determine input mode and whether to read stdin, items are split as they are read while building commands
+    input_fd = None
     if args.input_mode in ["f", "p", "a", "s"]:
         short_forms = {"f": "file", "p": "path", "a": "abspath", "s": "stdin"}
         args.input_mode = short_forms[args.input_mode]
     if args.command_pickle is not None:
         args.input_mode = args.command_pickle[0]
     elif args.arg_file is not None and (args.input_mode is None or args.input_mode == "stdin"):
-        with open(args.arg_file, "r") as fd:
-            stdin = fd.read()
+        input_fd = open(args.arg_file, "rb")
         args.input_mode = "stdin"
     elif args.input_mode is None:
         if not sys.stdin.isatty():
-            stdin = sys.stdin.read()
+            input_fd = sys.stdin.buffer
             args.input_mode = "stdin"
         else:
             args.input_mode = "file"
     elif args.input_mode == "stdin":
-        stdin = sys.stdin.read()
+        input_fd = sys.stdin.buffer
     # need to open new tty for interactive mode if input was piped to stdin (unless handled later if run subprocesses with multiplexer is requested)
     if args.interactive and not sys.stdin.isatty() and not (args.procs is not None and args.chunk is None and not args.no_mux):
         sys.stdin = open("/dev/tty")
-    # set delimiter
-    if args.null:
-        args.delim = "\0"
-    elif args.lines:
-        args.delim = "\n"
-    # enable format string mode
-    if args.re_split is not None or args.re_groups is not None:
-        args.format_str = True
-    # enable f-string mode
-    if args.pyprt:
-        args.fstring = True
+    prepare_args(args)
     # check for unsupported options on windows and prepend cmd.exe /c to commands that don't start with an executable (too annoying to check which shell was used on windows)
     if sys.platform.startswith("win32"):
+        import shutil
         if not (args.subprocess_shell or args.pyex or args.pyev or args.pyprt or args.sql):
             if len(args.command) >= 1 and not shutil.which(args.command[0]):
                 args.command = ["cmd.exe", "/c"] + args.command
@@ -485,11 +2605,13 @@ def main() -> int:
         assert not args.top_level, "invalid option --top for input mode: stdin"
         assert not args.symlinks, "invalid option --symlinks for input mode: stdin"
         assert not args.regex_basename, "invalid option -b for input mode: stdin"
+        assert not args.unsorted, "invalid option --unsorted for input mode: stdin"
+        assert args.incremental is None, "invalid option --incremental for input mode: stdin"
+        assert not (args.prune or args.include or args.exclude or args.max_depth is not None or args.min_depth or args.entry_type or args.size or args.mtime or args.newer), "invalid option --prune, --max-depth, --min-depth, --include, --exclude, --type, --size, --mtime, or --newer for input mode: stdin"
     else:
         assert not args.null, f"invalid option --null for input mode: {args.input_mode}"
         assert args.delim is None, f"invalid option --delimiter for input mode: {args.input_mode}"
         assert args.arg_file is None, f"invalid option --arg-file for input mode: {args.input_mode}"
-    assert not args.format_str or args.replace_str is None, "invalid option --format-str: cannot specify -I replace-str"
     assert not (args.re_split and args.re_groups), "invalid option: cannot specify both --split and --groups"
     assert not args.regex_omit or args.regex_filter is not None, "invalid option -o: requires -r regex"
     assert not args.regex_basename or args.regex_filter is not None, "invalid option -b: requires -r regex"
@@ -500,22 +2622,80 @@ def main() -> int:
     assert not args.no_mux or args.procs is not None, "invalid option --no-mux: --procs must be specified"
     assert not args.no_mux or args.chunk is None, "invalid option --no-mux: --chunk must not be specified"
     assert not args.no_mux or not args.interactive, "invalid option --no-mux: interactive mode not supported"
+    assert not args.stream or args.procs is None or args.no_mux, "invalid option --stream: not supported with --procs unless --no-mux"
+    assert args.serve is None or not (args.interactive or args.stream or args.keep_order or args.jsonl or args.jobs is not None or args.chunk is not None), "invalid option --serve: cannot specify --interactive, --stream, --keep-order, --jsonl, --jobs, or --chunk"
+    assert not args.ssh or args.serve is not None, "invalid option --ssh: requires --serve"
+    assert not (args.load_max is not None or args.mem_free is not None or args.psi_max is not None) or args.jobs is not None or args.no_mux, "invalid option --load-max, --mem-free, or --psi-max: requires --jobs or --no-mux"
+    assert not (args.load_max is not None or args.mem_free is not None or args.psi_max is not None or args.delay) or args.serve is None, "invalid option --load-max, --mem-free, --psi-max, or --delay: not supported with --serve"
+    assert args.delay >= 0, "invalid option --delay: requires secs >= 0"
+    assert not args.results_output or args.results is not None, "invalid option --results-output: requires --results"
+    assert not args.results_output or args.jobs is not None or args.no_mux or args.serve is not None, "invalid option --results-output: requires --jobs, --no-mux, or --serve"
+    assert not args.vector or args.pyev or args.pyex, "invalid option --vector: requires -e or -x"
+    assert not args.vector or not args.resub and all(args.replace_str not in arg for arg in args.command), "invalid option --vector: the code cannot contain the input (replace-str or --resub), use X or S instead"
+    assert not args.vector or not (args.interactive or args.procs is not None or args.serve is not None or args.max_args is not None or args.dataframe or args.json or args.jsonl), "invalid option --vector: cannot specify --interactive, --procs, --serve, --max-args, --df, --js, or --jsonl"
+    assert args.order is None or not (args.stream or args.jsonl), "invalid option --order: cannot specify --stream or --jsonl"
+    assert args.order != "history" or args.joblog is not None, "invalid option --order history: requires --joblog"
+    assert args.vector_size > 0, "invalid option --vector-size: requires n > 0"
+    assert args.max_depth is None or args.max_depth >= 1, "invalid option --max-depth: requires n >= 1"
+    assert args.newer is None or os.path.exists(args.newer), f"invalid option --newer: file not found: {args.newer}"
+    assert args.out_maxlen is None or args.out_maxlen >= 0, "invalid option --out-maxlen: requires n >= 0"
+    assert args.chunksize is None or args.chunksize > 0, "invalid option --chunksize: requires n > 0"
+    assert not args.post_worker or args.no_mux, "invalid option --post-worker: requires --no-mux"
+    assert not args.group or args.jobs is not None or args.no_mux or args.serve is not None, "invalid option --group: requires --jobs, --no-mux, or --serve"
+    assert not (args.resume or args.resume_failed) or args.joblog is not None, "invalid option --resume: requires --joblog"
+    assert not (args.incremental_hash or args.force) or args.incremental is not None, "invalid option --incremental-hash or --force: requires --incremental"
+    assert args.max_args is None or args.max_args >= 0, "invalid option --max-args: requires n >= 0"
+    assert args.max_args is None or not (args.pyex or args.pyev or args.pyprt or args.sql or args.fstring or args.format_str or args.resub), "invalid option --max-args: only supported for commands executed as subprocesses without formatting"
+    assert not args.sql_union or args.sql, "invalid option --sql-union: requires --sql"
+    assert not args.sql_union or not args.dataframe, "invalid option --sql-union: cannot specify --df"
+    assert not args.sql_union or args.static_command, "invalid option --sql-union: the query cannot contain the input (replace-str, --format, or --resub), use variables instead"
+    assert not (args.df_sep is not None or args.df_arrow or args.df_columns is not None or args.df_concat or args.df_engine != "c") or args.dataframe, "invalid option --df-sep, --df-engine, --df-arrow, --df-columns, or --df-concat: requires --df"
+    assert not args.df_concat or args.max_args is None, "invalid option --df-concat: cannot specify --max-args"
+    assert not args.df_concat or args.static_command, "invalid option --df-concat: the command cannot contain the input (replace-str, --format, or --resub), use variables instead"
+    assert not args.jsonl or args.static_command, "invalid option --jsonl: the command cannot contain the input (replace-str, --format, or --resub), use variables instead"
+    assert not args.jsonl or not (args.sql or args.procs is not None or args.jobs is not None or args.max_args is not None or args.interactive), "invalid option --jsonl: cannot specify --sql, --procs, --jobs, --max-args, or --interactive"
+    assert args.js_keys is None or args.json or args.jsonl, "invalid option --js-keys: requires --js or --jsonl"
+    assert args.jobs is None or args.jobs > 0, "invalid option --jobs: requires N > 0"
+    assert args.jobs is None or args.procs is None, "invalid option --jobs: cannot specify --procs"
+    assert args.jobs is None or not args.interactive, "invalid option --jobs: interactive mode not supported"
+    assert args.jobs is None or not (args.pyex or args.pyev or args.pyprt or args.sql), "invalid option --jobs: only supported for commands executed as subprocesses"
+    assert not args.progress or not args.interactive, "invalid option --progress: interactive mode not supported"
+    assert args.max_args is None or all(arg == args.replace_str or args.replace_str not in arg for arg in args.command), "invalid option --max-args: replace-str must be a separate argument"
+    # open the incremental cache used while building commands and after running them
+    global incremental_cache
+    incremental_cache = IncrementalCache(args) if args.incremental is not None and len(args.command) >= 1 else None
+    if incremental_cache is not None:
+        atexit.register(incremental_cache.close)
     # build and run commands
     if len(args.command) >= 1:
         # build commands or load them from pickle if available
-        if args.command_pickle is None:
-            command_dicts = build_commands(args, stdin)
+        if args.jsonl and args.input_mode == "stdin":
+            # records are streamed by execute_jsonl instead of splitting the input into commands
+            commands = [Command(args.base_dir, "-" if args.arg_file is None else args.arg_file)]
+        elif args.stream:
+            commands = pack_commands(args, generate_commands(args, read_items(input_fd, args.delim) if input_fd is not None else []))
+            if args.sql_union or args.df_concat:
+                commands = union_commands(args, commands)
+        elif args.command_pickle is None:
+            commands = build_commands(args, read_items(input_fd, args.delim) if input_fd is not None else [])
         else:
-            with open(args.command_pickle[1], "rb") as fd:
-                command_dicts = pickle.load(fd)
+            commands = ClaimQueue(args, args.command_pickle[1])
+        # records are read from the file again in binary by execute_jsonl
+        if args.arg_file is not None and input_fd is not None and not args.stream:
+            input_fd.close()
         # start subprocesses with multiplexer if requested then exit
         if args.procs is not None and args.chunk is None and not args.no_mux:
+            import pickle
+            import shutil
+            import subprocess
+            import tempfile
             multiplexer = "byobu" if shutil.which("byobu") else "tmux" if shutil.which("tmux") else None
             assert multiplexer is not None, "multiplexer not found: install byobu or tmux"
             session = time.strftime("pyxargs_%Y%m%d_%H%M%S")
-            # write commands to pickle
+            # write commands to pickle after the counter of commands claimed by the chunks
             command_pickle = tempfile.NamedTemporaryFile()
-            pickle.dump(command_dicts, command_pickle.file)
+            command_pickle.file.write(bytes(ClaimQueue.HEADER_SIZE))
+            pickle.dump(commands, command_pickle.file)
             command_pickle.file.flush()
             # start multiplexer session
             pyxargs_command = [sys.executable, os.path.abspath(__file__), "--chunk", "0", "--_command_pickle", args.input_mode, command_pickle.name] + sys.argv[1:]
@@ -533,13 +2713,17 @@ def main() -> int:
             else:
                 subprocess.run([multiplexer, "attach-session", "-t", session])
             return 0
-        # execute commands (only specific chunk if requested)
+        # execute commands (only specific chunk if requested, chunks started with a multiplexer take commands as they are free)
         if args.chunk is None:
-            return execute_commands(args, command_dicts)
-        else:
-            _ = execute_commands(args, command_dicts[args.chunk::args.procs])
+            return execute_commands(args, commands)
+        elif args.command_pickle is None:
+            _ = execute_commands(args, commands[args.chunk::args.procs])
             _ = input(f"Chunk {args.chunk} complete. Press enter to exit. ")
             return 0
+        else:
+            _ = execute_commands(args, commands)
+            _ = input(f"Chunk {args.chunk} complete, took {commands.taken} of {len(commands)} commands. Press enter to exit. ")
+            return 0
     else:
         parser.print_usage()
         return 2
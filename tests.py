@@ -1,5 +1,8 @@
+import importlib.util
+import json
 import os
 import shutil
+import tempfile
 import unittest
 
 class TestPyxargs(unittest.TestCase):
@@ -15,6 +18,12 @@ class TestPyxargs(unittest.TestCase):
         os.remove("test.txt")
         shutil.rmtree("__pycache__", True)
 
+    def temp_path(self, name):
+        # files written by a test are kept out of the repo, since other tests list its contents
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        return os.path.join(directory, name)
+
     def test_stdin(self):
         cmd = "echo hello world | python pyxargs.py -m stdin echo out {}"
         with os.popen(cmd) as result:
@@ -31,7 +40,7 @@ class TestPyxargs(unittest.TestCase):
         cmd = "python pyxargs.py -r \"(\.git|__pycache__)\" -o echo out {}"
         with os.popen(cmd) as result:
             result = result.readlines()
-            self.assertEqual(result, ['out LICENSE\n', 'out README.md\n', 'out pyxargs.py\n', 'out setup.py\n', 'out test.txt\n', 'out tests.py\n'])
+            self.assertEqual(result, ['out LICENSE\n', 'out README.md\n', 'out benchmarks.py\n', 'out pyxargs.py\n', 'out setup.py\n', 'out test.txt\n', 'out tests.py\n'])
 
     def test_re_filter_file_path(self):
         cmd = "python pyxargs.py -r \"\Aconfig\" echo out {}"
@@ -58,13 +67,13 @@ class TestPyxargs(unittest.TestCase):
         cmd = "python pyxargs.py -r \".+\.py$\" echo out {}"
         with os.popen(cmd) as result:
             result = result.readlines()
-            self.assertEqual(result, ['out pyxargs.py\n', 'out setup.py\n', 'out tests.py\n'])
+            self.assertEqual(result, ['out benchmarks.py\n', 'out pyxargs.py\n', 'out setup.py\n', 'out tests.py\n'])
 
     def test_resub(self):
         cmd = "python pyxargs.py -r \".+\.py$\" --resub \"\.py\" \".txt\" \"{}\" echo out {}"
         with os.popen(cmd) as result:
             result = result.readlines()
-            self.assertEqual(result, ['out pyxargs.txt\n', 'out setup.txt\n', 'out tests.txt\n'])
+            self.assertEqual(result, ['out benchmarks.txt\n', 'out pyxargs.txt\n', 'out setup.txt\n', 'out tests.txt\n'])
 
     def test_re_omit(self):
         cmd = "python pyxargs.py -r \"(.+\.py)|(\.git)\" -o echo out {}"
@@ -143,6 +152,15 @@ class TestPyxargs(unittest.TestCase):
             result = result.readlines()
             self.assertListEqual(result, solution)
 
+    def test_read_items_bytes(self):
+        path = self.temp_path("test_items.bin")
+        with open(path, "wb") as f:
+            f.write(b"a b\0\xff.txt\n")
+        cmd = "python pyxargs.py -a " + path + " -0 python -c \"import os, sys; print(os.fsencode(sys.argv[1]))\""
+        with os.popen(cmd) as result:
+            result = result.readlines()
+            self.assertEqual(result, ["b'a b'\n", "b'\\xff.txt'\n"])
+
     def test_read_items_cat_type(self):
         if os.name == "nt":
             cmd = "type test.txt | python pyxargs.py -m stdin echo out {}"
@@ -159,5 +177,249 @@ class TestPyxargs(unittest.TestCase):
             result = result.readlines()
             self.assertEqual(result, solution)
 
+    def test_stream(self):
+        cmd = "echo hello,world,bye,world , | python pyxargs.py --stream -d , -x \"print('{}')\""
+        with os.popen(cmd) as result:
+            result = result.readlines()
+            self.assertEqual(result, ['hello\n', 'world\n', 'bye\n', 'world \n', '\n'])
+
+    def test_stream_vars(self):
+        cmd = "echo hello world | python pyxargs.py --stream -p \"{i} {x} {n}\""
+        with os.popen(cmd) as result:
+            result = result.readlines()
+            self.assertEqual(result, ['0 hello ERROR: var not available with --stream\n', '1 world ERROR: var not available with --stream\n'])
+
+    def test_jobs(self):
+        cmd = "echo hello world bye world | python pyxargs.py -j 3 echo out {}"
+        with os.popen(cmd) as result:
+            result = result.readlines()
+            self.assertEqual(sorted(result), ['out bye\n', 'out hello\n', 'out world\n', 'out world\n'])
+
+    def test_exit_status(self):
+        cmd = "echo 0 1 0 | python pyxargs.py -j 2 python -c \"import sys; sys.exit({})\""
+        result = os.popen(cmd)
+        result.read()
+        self.assertEqual(os.waitstatus_to_exitcode(result.close()), 123)
+        # without -j the exit status is unchanged
+        result = os.popen(cmd.replace("-j 2 ", ""))
+        result.read()
+        self.assertIsNone(result.close())
+
+    def test_max_args(self):
+        cmd = "echo 1 2 3 4 5 | python pyxargs.py --max-args 2 echo out {} end"
+        with os.popen(cmd) as result:
+            result = result.readlines()
+            self.assertEqual(result, ['out 1 2 end\n', 'out 3 4 end\n', 'out 5 end\n'])
+
+    def test_max_args_max_chars(self):
+        cmd = "echo 1 2 3 4 5 | python pyxargs.py --max-args 0 --max-chars 12 echo out"
+        with os.popen(cmd) as result:
+            result = result.readlines()
+            self.assertEqual(result, ['out 1 2\n', 'out 3 4\n', 'out 5\n'])
+
+    def test_max_args_shell_quoting(self):
+        # each ' is quoted as '"'"' in the shell command, which must still fit in a single argument
+        path = self.temp_path("test_quotes.txt")
+        with open(path, "w") as f:
+            f.write("\n".join(["'" * 60] * 3000))
+        result = os.popen("python pyxargs.py -a " + path + " -l --sh --max-args 0 true")
+        result.read()
+        self.assertIsNone(result.close())
+
+    def test_jobs_keep_order(self):
+        cmd = "echo 3 2 1 | python pyxargs.py -j 3 -k python -c \"import time; time.sleep({}/10); print({})\""
+        with os.popen(cmd) as result:
+            result = result.readlines()
+            self.assertEqual(result, ['3\n', '2\n', '1\n'])
+
+    def test_jobs_throttle(self):
+        cmd = "echo 1 2 3 | python pyxargs.py -j 2 -k --load-max 1000 --mem-free 1K --delay 0.01 echo out"
+        with os.popen(cmd) as result:
+            result = result.readlines()
+            self.assertEqual(result, ['out 1\n', 'out 2\n', 'out 3\n'])
+
+    def test_jobs_tag(self):
+        cmd = "echo hello world | python pyxargs.py -j 2 -k --tag echo out"
+        with os.popen(cmd) as result:
+            result = result.readlines()
+            self.assertEqual(result, ['hello\tout hello\n', 'world\tout world\n'])
+
+    def test_no_mux_results(self):
+        cmd = "echo 1 2 3 4 5 | python pyxargs.py -P 3 --no-mux -k --post \"print(sorted(out), i)\" -e \"int(x) * i\""
+        with os.popen(cmd) as result:
+            result = result.readlines()
+            self.assertEqual(result, ['0\n', '2\n', '6\n', '12\n', '20\n', '[0, 2, 6, 12, 20] 4\n'])
+
+    def test_post_worker(self):
+        cmd = "seq 100 | python pyxargs.py -P 3 --no-mux --pre \"t=0\" --post-worker \"t\" --post \"print(sum(parts), len(parts))\" -x \"t+=int(x)\""
+        with os.popen(cmd) as result:
+            self.assertEqual(result.readlines(), ["5050 3\n"])
+        # --pre runs once in each worker and not in the main process, libraries are still imported for --post
+        cmd = "echo 1 2 3 | python pyxargs.py -P 3 --no-mux --import math --pre \"print('pre', flush=True)\" --post \"print(math.pi)\" -e \"x\""
+        with os.popen(cmd) as result:
+            result = result.readlines()
+            self.assertEqual(("".join(result).count("pre"), result[-1]), (3, "3.141592653589793\n"))
+
+    def test_serve(self):
+        cmd = "seq 20 | python pyxargs.py --serve 0 -P 3 --post \"print(sorted(out) == list(range(2, 41, 2)), len(out))\" -e \"int(x) * 2\" 2>/dev/null"
+        with os.popen(cmd) as result:
+            result = result.readlines()
+            self.assertEqual(result[-1], "True 20\n")
+
+    def test_claim_queue(self):
+        # chunks started with a multiplexer share a pickle of commands and take the next one as they become free
+        claims = self.temp_path("test_claims.pickle")
+        script = f"import pickle, os, pyxargs; f = open('{claims}', 'wb'); f.write(bytes(8)); pickle.dump([pyxargs.Command(os.getcwd(), str(k)) for k in range(4)], f)"
+        cmd = f"python -c \"{script}\" && for c in 0 1; do echo | python pyxargs.py --chunk $c --_command_pickle stdin {claims} -P 2 -e x; echo; done"
+        with os.popen(cmd) as result:
+            result = result.readlines()
+            self.assertEqual(result, ['0\n', '1\n', '2\n', '3\n',
+                                      'Chunk 0 complete, took 4 of 4 commands. Press enter to exit. \n',
+                                      'Chunk 1 complete, took 0 of 4 commands. Press enter to exit. \n'])
+
+    def test_static_command(self):
+        cmd = "echo \"it's\" \"a\\\"b\" | python pyxargs.py -e \"x.upper()\""
+        with os.popen(cmd) as result:
+            result = result.readlines()
+            self.assertEqual(result, ["IT'S\n", 'A"B\n'])
+
+    def test_unsorted(self):
+        cmd = "python pyxargs.py -m path --unsorted --walk-threads 4 -r \"\\.py$\" echo out {}"
+        with os.popen(cmd + " < " + os.devnull) as result:
+            result = result.readlines()
+            self.assertEqual(sorted(result), ['out benchmarks.py\n', 'out pyxargs.py\n', 'out setup.py\n', 'out tests.py\n'])
+
+    def test_walk_predicates(self):
+        cmd = "python pyxargs.py -m path --prune .git --max-depth 1 --include \"*.py\" --exclude \"setup*\" --size=+1 echo out {}"
+        with os.popen(cmd) as result:
+            result = result.readlines()
+            self.assertEqual(result, ['out benchmarks.py\n', 'out pyxargs.py\n', 'out tests.py\n'])
+
+    def test_walk_symlinks(self):
+        # symlinks to directories are listed by --type l, but not followed
+        directory = os.path.dirname(self.temp_path(""))
+        os.mkdir(os.path.join(directory, "folder"))
+        os.symlink("folder", os.path.join(directory, "link_folder"))
+        os.symlink("missing", os.path.join(directory, "link_missing"))
+        cmd = "cd " + directory + " && python " + os.path.abspath("pyxargs.py") + " -m path --type l echo out {}"
+        with os.popen(cmd) as result:
+            result = result.readlines()
+            self.assertEqual(result, ['out link_folder\n', 'out link_missing\n'])
+
+    def test_joblog_resume(self):
+        joblog = self.temp_path("test_joblog.tsv")
+        cmd = f"echo 0 1 2 | python pyxargs.py --joblog {joblog} python -c \"import sys; sys.exit({{}})\""
+        os.popen(cmd).close()
+        cmd = f"echo 0 1 2 3 | python pyxargs.py --joblog {joblog} --resume-failed echo out {{}}"
+        with os.popen(cmd) as result:
+            result = result.readlines()
+            self.assertEqual(result, ['out 1\n', 'out 2\n', 'out 3\n'])
+        cmd = f"echo 0 1 2 3 4 | python pyxargs.py --joblog {joblog} --resume echo out {{}}"
+        with os.popen(cmd) as result:
+            result = result.readlines()
+            self.assertEqual(result, ['out 4\n'])
+
+    def test_incremental(self):
+        cache = self.temp_path("test_cache.sqlite")
+        cmd = f"python pyxargs.py -m path --incremental {cache} -r \"\\.py$\" echo out {{}} < " + os.devnull
+        with os.popen(cmd) as result:
+            result = result.readlines()
+            self.assertEqual(result, ['out benchmarks.py\n', 'out pyxargs.py\n', 'out setup.py\n', 'out tests.py\n'])
+        with os.popen(cmd) as result:
+            result = result.readlines()
+            self.assertEqual(result, [])
+        with os.popen(cmd.replace("--incremental", "--force --incremental")) as result:
+            result = result.readlines()
+            self.assertEqual(result, ['out benchmarks.py\n', 'out pyxargs.py\n', 'out setup.py\n', 'out tests.py\n'])
+
+    def test_stats(self):
+        path = self.temp_path("test_stats.json")
+        cmd = "echo 0 1 2 | python pyxargs.py --stats " + path + " --post \"print(stats.commands)\" python -c \"import sys; sys.exit({})\""
+        with os.popen(cmd) as result:
+            result = result.readlines()
+            self.assertEqual(result, ['3\n'])
+        with open(path, "r") as f:
+            result = json.load(f)
+            self.assertEqual(result["exit_status"], {'0': 1, '1': 1, '2': 1})
+            self.assertEqual(sum(result["histogram"].values()), 3)
+            self.assertEqual(list(result["phases"])[:2], ["read", "build"])
+            duration = result["duration"]
+            self.assertTrue(duration["min"] <= duration["p50"] <= duration["p90"] <= duration["max"])
+
+    def test_order(self):
+        cmd = "python pyxargs.py -m path --max-depth 1 --include \"*.py\" --order size-desc -j 2 -k echo out {}"
+        with os.popen(cmd) as result:
+            result = result.readlines()
+            self.assertEqual(result, ['out pyxargs.py\n', 'out tests.py\n', 'out benchmarks.py\n', 'out setup.py\n'])
+
+    def test_results(self):
+        path = self.temp_path("test_results.jsonl")
+        cmd = "echo 1 2 | python pyxargs.py -j 2 --results " + path + " --results-output sh -c \"echo out {}; exit {}\" > /dev/null"
+        with os.popen(cmd) as result:
+            result.read()
+        with open(path, "r") as f:
+            records = sorted((json.loads(line) for line in f), key=lambda record: record["input"])
+        self.assertEqual([(r["input"], r["exit"], r["stdout"], r["command"]) for r in records], [("1", 1, "out 1\n", "sh -c 'echo out 1; exit 1'"), ("2", 2, "out 2\n", "sh -c 'echo out 2; exit 2'")])
+        self.assertEqual(sorted(r["seq"] for r in records), [1, 2])
+
+    def test_vector(self):
+        cmd = "printf 'a,1\\nb,2\\nc,3\\n' | python pyxargs.py -l --vector --vector-size 2 -s , -e \"[row[0].upper() + str(i) for row in S]\""
+        with os.popen(cmd) as result:
+            result = result.readlines()
+            self.assertEqual(result, ['A0\n', 'B0\n', 'C2\n'])
+        cmd = "printf 'a,1\\nb\\n' | python pyxargs.py -l --vector -s , -e \"[len(row) for row in S]\""
+        with os.popen(cmd) as result:
+            result = result.readlines()
+            self.assertEqual(result, ['2\n', '1\n'])
+
+    def test_out_maxlen(self):
+        cmd = "echo 1 2 3 4 | python pyxargs.py --out-maxlen 2 --post \"print(list(out), a[-1])\" -e \"int(x) * 2\""
+        with os.popen(cmd) as result:
+            result = result.readlines()
+            self.assertEqual(result, ['2\n', '4\n', '6\n', '8\n', "[6, 8] 4\n"])
+
+    def test_jsonl(self):
+        cmd = "printf '{\"a\": 1, \"b\": 2}\\n\\n{\"a\": 3}\\n' | python pyxargs.py --jsonl --js-keys a -e \"(i, js)\""
+        with os.popen(cmd) as result:
+            result = result.readlines()
+            self.assertEqual(result, ["(0, {'a': 1})\n", "(1, {'a': 3})\n"])
+        # records run as they arrive instead of waiting for a full batch
+        cmd = "(echo '{\"a\": 1}'; sleep 1; echo '{\"a\": 2}') | python pyxargs.py --jsonl --pre \"import time; t = time.time()\" -e \"(js['a'], round(time.time() - t))\""
+        with os.popen(cmd) as result:
+            result = result.readlines()
+            self.assertEqual(result, ["(1, 0)\n", "(2, 1)\n"])
+        # integers wider than 64 bits are kept exact, and the source is not appended to the command
+        cmd = "printf '{\"n\": 99999999999999999999999}\\n' | python pyxargs.py --jsonl -e \"js['n'] + 1\""
+        with os.popen(cmd) as result:
+            result = result.readlines()
+            self.assertEqual(result, ["100000000000000000000000\n"])
+        cmd = "printf '{}\\n{}\\n' | python pyxargs.py --jsonl echo out"
+        with os.popen(cmd) as result:
+            result = result.readlines()
+            self.assertEqual(result, ["out\n", "out\n"])
+
+    @unittest.skipUnless(importlib.util.find_spec("duckdb"), "requires duckdb")
+    def test_sql_stdin(self):
+        cmd = "printf 'a,b\\n1,2\\n' | python pyxargs.py -d \";\" --post \"print(out[0].fetchall())\" -q \"select a + b from db\""
+        with os.popen(cmd) as result:
+            result = result.readlines()
+            self.assertEqual(result[-1], "[(3,)]\n")
+        cmd = "printf '{\"a\": 1}\\n{\"a\": 2}\\n' | python pyxargs.py -l --sql-union --post \"print(out[0].fetchall())\" -q \"select sum(a) from db\""
+        with os.popen(cmd) as result:
+            result = result.readlines()
+            self.assertEqual(result[-1], "[(3,)]\n")
+        cmd = "printf '{\"a\": 1}\\nx,y\\n' | python pyxargs.py -l --sql-union -q \"select * from db\" 2>&1"
+        with os.popen(cmd) as result:
+            result = result.readlines()
+            self.assertEqual(result, ["Could not read inputs as a single relation, --sql-union requires inputs of the same format (csv or json), found: csv, json\n"])
+
+    def test_import_time(self):
+        cmd = "python -X importtime -c 'import pyxargs' 2>&1"
+        with os.popen(cmd) as result:
+            result = {line.split("|")[2].strip(): int(line.split("|")[1]) for line in result.readlines() if line.startswith("import time:") and line.split("|")[1].strip().isdigit()}
+            self.assertLess(result["pyxargs"], 100000)
+            for module in ["concurrent.futures", "json", "multiprocessing", "pickle", "shutil", "sqlite3", "subprocess", "tempfile", "threading"]:
+                self.assertNotIn(module, result)
+
 if __name__ == '__main__':
     unittest.main()